@@ -0,0 +1,64 @@
+from multiprocessing import shared_memory
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """
+    CancelToken is the flag of cancelling the job. The flag is
+    one byte of shared memory, so worker processes get the token
+    with the instance (by the name of the block) and check it
+    without the manager. The creator of the token frees the block.
+
+    """
+
+    def __init__(self):
+        self.block = shared_memory.SharedMemory(create=True, size=1)
+        self.block.buf[0] = 0
+        self.name = self.block.name
+        self.owner = True
+
+    def __getstate__(self):
+        return {'name': self.name}
+
+    def __setstate__(self, state) -> None:
+        self.name = state['name']
+        self.block = None
+        self.owner = False
+
+    def get_block(self) -> shared_memory.SharedMemory:
+        if self.block is None:
+            self.block = shared_memory.SharedMemory(name=self.name)
+
+        return self.block
+
+    def cancel(self) -> None:
+        self.get_block().buf[0] = 1
+
+    def reset(self) -> None:
+        self.get_block().buf[0] = 0
+
+    @property
+    def cancelled(self) -> bool:
+        try:
+            return bool(self.get_block().buf[0])
+        except FileNotFoundError:
+            # the job of the owner is finished
+            return False
+
+    def check(self) -> None:
+        """
+        Raise JobCancelled if the job is cancelled
+        """
+
+        if self.cancelled:
+            raise JobCancelled()
+
+    def close(self) -> None:
+        if self.block is not None:
+            self.block.close()
+            if self.owner:
+                self.block.unlink()
+            self.block = None
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Set
+
+
+class JobManifest:
+    """
+    JobManifest keeps the state of the job next to parts
+    ('<out_filename>.job.json'): the stamp of the source file,
+    settings of splitting, planned parts (start, end seconds)
+    and exported parts with their sizes and SHA-256 hashes.
+    The restarted job with the same source and settings
+    uses planned parts and skips exported parts.
+
+    """
+
+    def __init__(self, out_filename, input_file, settings, parts):
+        self.out_filename = out_filename
+        self.file_name = f'{out_filename}.job.json'
+        self.source = self.source_stamp(input_file)
+        self.settings = json.loads(json.dumps(settings))
+        self.parts = [tuple(part) for part in parts]
+        self.exported = {}
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def source_stamp(input_file) -> List:
+        stat = os.stat(input_file)
+        return [os.path.abspath(input_file), stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def hash_file(file_name, block_size=1 << 20) -> str:
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            while data := f.read(block_size):
+                digest.update(data)
+
+        return digest.hexdigest()
+
+    @classmethod
+    def load(cls, out_filename, input_file, settings):
+        """
+        Load the manifest of the job and check exported parts.
+        Returns None if there is no manifest or the source
+        or settings were changed.
+        """
+
+        try:
+            with open(f'{out_filename}.job.json') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        manifest = cls(out_filename, input_file, settings, data.get('parts', []))
+        if (data.get('source') != manifest.source or
+                data.get('settings') != manifest.settings):
+            return None
+
+        manifest.exported = data.get('exported', {})
+        manifest.done = manifest.verify()
+
+        return manifest
+
+    def verify(self) -> Set[int]:
+        """
+        Return numbers of exported parts which files
+        are not changed after exporting
+        """
+
+        done = set()
+        for n, part in self.exported.items():
+            file_name = f'{self.out_filename}_{n}'
+            try:
+                if (os.path.getsize(file_name) == part['size'] and
+                        self.hash_file(file_name) == part['sha256']):
+                    done.add(int(n))
+            except OSError:
+                pass
+
+        return done
+
+    def add_part(self, n) -> None:
+        """
+        Record the exported part
+        """
+
+        file_name = f'{self.out_filename}_{n}'
+        part = {'size': os.path.getsize(file_name),
+                'sha256': self.hash_file(file_name)}
+
+        with self.lock:
+            self.exported[str(n)] = part
+            self.done.add(n)
+            self.save()
+
+    def save(self) -> None:
+        """
+        Write the manifest to the file
+        """
+
+        tmp_file = f'{self.file_name}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'source': self.source,
+                       'settings': self.settings,
+                       'parts': self.parts,
+                       'exported': self.exported}, f, indent=1)
+        os.replace(tmp_file, self.file_name)
@@ -0,0 +1,81 @@
+import os
+import json
+from typing import Dict
+
+
+class MediaInfoCache:
+    """
+    MediaInfoCache keeps parameters of audio files (duration, format,
+    sample rate, channels) keyed by the file path, size and mtime,
+    so the file is probed once. One cache is shared by the GUI and
+    the splitter, worker processes get a copy with the instance.
+    With 'cache_file' entries are kept in the JSON file for next runs.
+
+    """
+
+    def __init__(self, cache_file=None, max_entries=1000):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.entries = {}
+
+        if cache_file is not None:
+            try:
+                with open(cache_file) as f:
+                    self.entries = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+    def source_key(self, input_file) -> str:
+        """
+        Key of the source file by path, size and mtime
+        """
+
+        stat = os.stat(input_file)
+        return f'{os.path.abspath(input_file)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+    def get(self, input_file, probe) -> Dict:
+        """
+        Return parameters of the file, call probe(input_file)
+        if the file is not in the cache or it was changed
+        """
+
+        key = self.source_key(input_file)
+        if key in self.entries:
+            return dict(self.entries[key])
+
+        parameters = probe(input_file)
+
+        # old entries of the file and the oldest entries are removed
+        path = key.rsplit('|', 2)[0]
+        for old_key in [old_key for old_key in self.entries
+                        if old_key.rsplit('|', 2)[0] == path]:
+            del self.entries[old_key]
+        while len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+        self.entries[key] = dict(parameters)
+        self.save()
+
+        return parameters
+
+    def save(self) -> None:
+        """
+        Write entries to the cache file
+        """
+
+        if self.cache_file is None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)),
+                        exist_ok=True)
+            tmp_file = f'{self.cache_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as err:
+            print(f'Media info cache is not saved({err}).')
+
+    def clear(self) -> None:
+        self.entries = {}
+        self.save()
@@ -0,0 +1,279 @@
+import os
+import mmap
+import struct
+from typing import Dict, Tuple
+import numpy as np
+
+
+class Mp3Index:
+    """
+    Mp3Index parses headers of MPEG audio frames of the file
+    without decoding. It gives byte offsets and start times of frames,
+    so the file can be cut on frame boundaries by byte slicing.
+
+    """
+
+    # bitrates (kbit/s) by (MPEG version, layer)
+    BITRATES = {
+        (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+        (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    }
+
+    # sample rates by MPEG version
+    SAMPLE_RATES = {1: (44100, 48000, 32000),
+                    2: (22050, 24000, 16000),
+                    2.5: (11025, 12000, 8000)}
+
+    # ID3v2 frames for pydub-like tags
+    ID3_FRAMES = {'artist': 'TPE1', 'title': 'TIT2', 'album': 'TALB',
+                  'track': 'TRCK', 'genre': 'TCON', 'date': 'TYER',
+                  'year': 'TYER', 'album_artist': 'TPE2',
+                  'composer': 'TCOM'}
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+        with open(file_name, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.parse(data)
+
+    @classmethod
+    def parse_header(cls, header) -> Tuple[int, int, int, int, int]:
+        """
+        Parse 4 bytes of the frame header and return
+        (frame length, samples in frame, sample rate, bitrate, channels).
+        Returns None if it is not a valid header.
+        """
+
+        b1, b2, b3, b4 = header
+        if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+            return None
+
+        version = {0: 2.5, 2: 2, 3: 1}.get((b2 >> 3) & 3)
+        layer = {1: 3, 2: 2, 3: 1}.get((b2 >> 1) & 3)
+        bitrate_index = b3 >> 4
+        sample_rate_index = (b3 >> 2) & 3
+        if (version is None or layer is None or
+                bitrate_index in (0, 15) or sample_rate_index == 3):
+            return None
+
+        bitrate = cls.BITRATES[(min(version, 2), layer)][bitrate_index] * 1000
+        sample_rate = cls.SAMPLE_RATES[version][sample_rate_index]
+        padding = (b3 >> 1) & 1
+        channels = 1 if (b4 >> 6) == 3 else 2
+
+        if layer == 1:
+            return ((12 * bitrate // sample_rate + padding) * 4,
+                    384, sample_rate, bitrate, channels)
+
+        if layer == 3 and version != 1:
+            return (72 * bitrate // sample_rate + padding,
+                    576, sample_rate, bitrate, channels)
+
+        return (144 * bitrate // sample_rate + padding,
+                1152, sample_rate, bitrate, channels)
+
+    @classmethod
+    def probe(cls, file_name, head_size=1 << 16) -> Dict:
+        """
+        Get parameters of the file by the first frames without
+        parsing all frames: the number of frames is taken from
+        the Xing/Info or VBRI frame, duration of CBR files is
+        calculated by the size. Returns None if there are no frames.
+        """
+
+        end = os.path.getsize(file_name)
+        with open(file_name, 'rb') as f:
+            start = 0
+            head = f.read(10)
+            if head[:3] == b'ID3' and len(head) == 10:
+                size = 0
+                for byte in head[6:10]:
+                    size = (size << 7) | (byte & 0x7F)
+                start = 10 + size + 10 * bool(head[5] & 0x10)
+
+            if end >= 128:
+                f.seek(end - 128)
+                if f.read(3) == b'TAG':
+                    end -= 128
+
+            f.seek(start)
+            data = f.read(head_size)
+
+        # the first frame which is followed by a valid frame
+        position = data.find(b'\xff')
+        frame = None
+        while 0 <= position and position + 4 <= len(data):
+            frame = cls.parse_header(data[position:position + 4])
+            if frame is not None:
+                next_position = position + frame[0]
+                if (next_position + 4 > len(data) or
+                        cls.parse_header(data[next_position:next_position + 4])):
+                    break
+            frame = None
+            position = data.find(b'\xff', position + 1)
+
+        if frame is None:
+            return None
+
+        frame_len, samples, sample_rate, bitrate, channels = frame
+        first = data[position:position + frame_len]
+        audio_size = end - start - position
+
+        frames = None
+        for mark in (b'Xing', b'Info'):
+            offset = first.find(mark)
+            if 0 <= offset and offset + 12 <= len(first):
+                flags, = struct.unpack('>I', first[offset + 4:offset + 8])
+                if flags & 1:
+                    frames, = struct.unpack('>I', first[offset + 8:offset + 12])
+        offset = first.find(b'VBRI')
+        if 0 <= offset and offset + 18 <= len(first):
+            frames, = struct.unpack('>I', first[offset + 14:offset + 18])
+
+        # the Xing/Info/VBRI frame keeps info about the whole file only
+        if b'Xing' in first or b'Info' in first or b'VBRI' in first:
+            audio_size -= frame_len
+
+        if frames:
+            duration = frames * samples / sample_rate
+            bitrate = int(audio_size * 8 / duration)
+        else:
+            duration = audio_size * 8 / bitrate
+
+        return {'format_name': 'mp3', 'codec_name': 'mp3',
+                'duration': f'{duration:.6f}',
+                'sample_rate': str(sample_rate),
+                'channels': str(channels),
+                'bit_rate': str(bitrate)}
+
+    def parse(self, data) -> None:
+        """
+        Find all frames between ID3 tags
+        """
+
+        start = 0
+        end = len(data)
+
+        # ID3v2 tag in the beginning
+        if data[:3] == b'ID3' and end >= 10:
+            size = 0
+            for byte in data[6:10]:
+                size = (size << 7) | (byte & 0x7F)
+            start = 10 + size + 10 * bool(data[5] & 0x10)
+
+        # ID3v1 tag in the end
+        if end >= 128 and data[end - 128:end - 125] == b'TAG':
+            end -= 128
+
+        offsets = []
+        samples = []
+        position = start
+        synced = False
+        self.sample_rate = self.bitrate = self.channels = 0
+        while position + 4 <= end:
+            frame = self.parse_header(data[position:position + 4])
+
+            # the next frame must be valid too when frames are searched
+            if frame is not None and not synced:
+                next_position = position + frame[0]
+                if (next_position + 4 <= end and
+                        self.parse_header(data[next_position:next_position + 4]) is None):
+                    frame = None
+
+            if frame is None or position + frame[0] > end:
+                synced = False
+                position = data.find(b'\xff', position + 1, end)
+                if position < 0:
+                    break
+                continue
+
+            synced = True
+
+            if not offsets:
+                _, _, self.sample_rate, self.bitrate, self.channels = frame
+
+            offsets.append(position)
+            samples.append(frame[1] / frame[2])
+            position += frame[0]
+
+        # the Xing/Info/VBRI frame keeps info about the whole file only
+        self.info_frame = None
+        if offsets:
+            first = data[offsets[0]:offsets[1] if len(offsets) > 1 else position]
+            if b'Xing' in first or b'Info' in first or b'VBRI' in first:
+                offsets.pop(0)
+                samples.pop(0)
+                self.info_frame = first
+
+        self.offsets = np.array(offsets + [position if offsets else start],
+                                dtype=np.int64)
+        self.times = np.concatenate(([0], np.cumsum(samples)))
+        self.duration = float(self.times[-1])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def snap(self, seconds) -> int:
+        """
+        Return the index of the frame boundary
+        which is the nearest to the time
+        """
+
+        index = int(np.searchsorted(self.times, seconds))
+        if index > 0 and (index == len(self.times) or
+                          seconds - self.times[index - 1] <= self.times[index] - seconds):
+            index -= 1
+
+        return index
+
+    def cut(self, start, end, out_filename, tags=None,
+            block_size=1 << 20) -> Tuple[float, float]:
+        """
+        Copy frames from 'start' to 'end' seconds (snapped to frame
+        boundaries) to the new file without re-encoding.
+        Returns the real start and end times.
+        """
+
+        first = self.snap(start)
+        last = self.snap(end)
+        position = int(self.offsets[first])
+        stop = int(self.offsets[last])
+
+        with open(self.file_name, 'rb') as source, open(out_filename, 'wb') as out:
+            if tags:
+                out.write(self.id3_tag(tags))
+
+            source.seek(position)
+            while position < stop:
+                data = source.read(min(block_size, stop - position))
+                if not data:
+                    break
+                out.write(data)
+                position += len(data)
+
+        return float(self.times[first]), float(self.times[last])
+
+    @classmethod
+    def id3_tag(cls, tags) -> bytes:
+        """
+        Make ID3v2.3 tag with text frames
+        """
+
+        frames = b''
+        for key, value in tags.items():
+            frame_id = cls.ID3_FRAMES.get(key)
+            if frame_id is None:
+                continue
+            text = b'\x01' + str(value).encode('utf-16')
+            frames += (frame_id.encode() +
+                       struct.pack('>IH', len(text), 0) + text)
+
+        size = len(frames)
+        syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+        return b'ID3\x03\x00\x00' + syncsafe + frames
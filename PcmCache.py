@@ -0,0 +1,189 @@
+import os
+import json
+import hashlib
+import subprocess
+from typing import Dict
+import numpy as np
+import pydub
+
+
+class PcmCache:
+    """
+    PcmCache keeps decoded PCM data (16 bit) of audio files on disk.
+    Entries are keyed by the file path, size, mtime and the sample
+    format, and are read with numpy.memmap, so next runs and worker
+    processes slice audio data without decoding.
+    The least recently used entries are removed when the cache
+    is bigger than 'max_size' bytes.
+
+    """
+
+    def __init__(self, cache_dir=None, max_size=5 * 1024 ** 3):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'SmartAudioSplitter', 'pcm')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def source_key(self, input_file) -> str:
+        """
+        Key of the source file by path, size and mtime
+        """
+
+        stat = os.stat(input_file)
+        source = f'{os.path.abspath(input_file)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def entry(self, input_file) -> Dict:
+        """
+        Return metadata of the cached file or None
+        """
+
+        meta_path = os.path.join(self.cache_dir,
+                                 f'{self.source_key(input_file)}.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if not os.path.exists(meta['pcm_path']):
+            return None
+
+        # the access time is used for LRU eviction
+        os.utime(meta_path)
+
+        return meta
+
+    def get(self, input_file, frame_rate, channels) -> Dict:
+        """
+        Return metadata of the cached file, decode the file
+        by ffmpeg if it is not in the cache
+        """
+
+        meta = self.entry(input_file)
+        if (meta is not None and meta['frame_rate'] == frame_rate and
+                meta['channels'] == channels):
+            return meta
+
+        key = self.source_key(input_file)
+        pcm_path = os.path.join(self.cache_dir,
+                                f'{key}_{frame_rate}_{channels}_s16le.pcm')
+        tmp_path = f'{pcm_path}.{os.getpid()}.tmp'
+
+        args = ('ffmpeg', '-y', '-v', 'error',
+                '-i', input_file,
+                '-f', 's16le', '-acodec', 'pcm_s16le',
+                '-ar', str(frame_rate), '-ac', str(channels),
+                tmp_path)
+        popen = subprocess.Popen(args, stderr=subprocess.PIPE)
+        _, error = popen.communicate()
+        if popen.returncode:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(f'ffmpeg decoding error: {error.decode()}')
+        os.replace(tmp_path, pcm_path)
+
+        # the old entry of the file with another format is removed
+        if meta is not None and meta['pcm_path'] != pcm_path:
+            self.remove(meta)
+
+        meta = {'source': os.path.abspath(input_file),
+                'pcm_path': pcm_path,
+                'frame_rate': frame_rate,
+                'channels': channels,
+                'sample_width': 2,
+                'size': os.path.getsize(pcm_path)}
+        with open(os.path.join(self.cache_dir, f'{key}.json'), 'w') as f:
+            json.dump(meta, f)
+
+        self.evict(keep=pcm_path)
+
+        return meta
+
+    def open(self, input_file) -> np.memmap:
+        """
+        Open PCM data of the cached file as bytes memmap
+        """
+
+        meta = self.entry(input_file)
+        if meta is None:
+            raise KeyError(f'{input_file} is not in the cache')
+        if not meta['size']:
+            return np.zeros(0, dtype=np.uint8)
+
+        return np.memmap(meta['pcm_path'], dtype=np.uint8, mode='r')
+
+    def load(self, input_file, start_second=0,
+             duration=None) -> pydub.AudioSegment:
+        """
+        Load a chunk of the cached file like
+        pydub.AudioSegment.from_file(start_second, duration)
+        """
+
+        meta = self.entry(input_file)
+        if meta is None:
+            raise KeyError(f'{input_file} is not in the cache')
+
+        frame_rate = meta['frame_rate']
+        frame_width = meta['channels'] * meta['sample_width']
+        pcm = self.open(input_file)
+
+        start = int(start_second * frame_rate) * frame_width
+        if duration is None:
+            end = len(pcm)
+        else:
+            end = int((start_second + duration) * frame_rate) * frame_width
+
+        return pydub.AudioSegment(data=bytes(pcm[start:end]),
+                                  frame_rate=frame_rate,
+                                  sample_width=meta['sample_width'],
+                                  channels=meta['channels'])
+
+    def remove(self, meta) -> None:
+        """
+        Remove the entry from the cache
+        """
+
+        key = os.path.basename(meta['pcm_path']).split('_')[0]
+        for path in (meta['pcm_path'],
+                     os.path.join(self.cache_dir, f'{key}.json')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self, keep=None) -> None:
+        """
+        Remove the least recently used entries
+        while the cache is bigger than max_size
+        """
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.cache_dir, name)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta_path), meta))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+
+        total = sum(meta['size'] for _, meta in entries)
+        for _, meta in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_size:
+                break
+            if meta['pcm_path'] == keep:
+                continue
+            self.remove(meta)
+            total -= meta['size']
+
+    def clear(self) -> None:
+        """
+        Remove all entries
+        """
+
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
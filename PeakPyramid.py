@@ -0,0 +1,130 @@
+import os
+import zipfile
+import numpy as np
+from typing import Tuple
+from SilenceMap import SilenceMap
+
+
+class PeakPyramid:
+    """
+    PeakPyramid keeps min/max peaks of the audio for drawing
+    the waveform: the first level has a peak pair of every 'base'
+    samples, every next level merges pairs of the previous one.
+    Any view (zoom and position) is drawn from the level with
+    about one peak per pixel, so the audio is never decoded again.
+    It is saved next to the source file ('<file>.peaks.npz')
+    like SilenceMap.
+
+    """
+
+    def __init__(self, mins, maxs, frame_rate, base=256):
+        self.frame_rate = frame_rate
+        self.base = base
+        self.levels = [(mins, maxs)]
+        while len(mins) > 1:
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[::2], mins[1::2])
+            maxs = np.maximum(maxs[::2], maxs[1::2])
+            self.levels.append((mins, maxs))
+
+    @classmethod
+    def from_blocks(cls, blocks, frame_rate, channels, base=256):
+        """
+        Make the pyramid from blocks of raw PCM data (16 bit)
+        """
+
+        mins = []
+        maxs = []
+        rest = np.zeros(0, dtype=np.int16)
+        for data in blocks:
+            samples = np.concatenate((rest, np.frombuffer(data, dtype=np.int16)))
+            # peaks of all channels of 'base' frames
+            n = len(samples) // (base * channels)
+            bins = samples[:n * base * channels].reshape(n, base * channels)
+            mins.append(bins.min(axis=1))
+            maxs.append(bins.max(axis=1))
+            rest = samples[n * base * channels:]
+
+        if len(rest):
+            mins.append(rest.min(keepdims=True))
+            maxs.append(rest.max(keepdims=True))
+
+        if not mins:
+            return cls(np.zeros(0, dtype=np.int16),
+                       np.zeros(0, dtype=np.int16), frame_rate, base)
+
+        return cls(np.concatenate(mins), np.concatenate(maxs),
+                   frame_rate, base)
+
+    @property
+    def duration(self) -> float:
+        return len(self.levels[0][0]) * self.base / self.frame_rate
+
+    def peaks(self, start, end, width) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return start times (seconds), min and max peaks of
+        not more than 'width' columns of the view from 'start'
+        to 'end' seconds
+        """
+
+        samples_per_column = (end - start) * self.frame_rate / max(width, 1)
+        level = int(np.log2(max(samples_per_column / self.base, 1)))
+        level = min(level, len(self.levels) - 1)
+        mins, maxs = self.levels[level]
+        bin_len = self.base * 2 ** level
+
+        first = max(int(start * self.frame_rate // bin_len), 0)
+        last = min(int(-(-end * self.frame_rate // bin_len)), len(mins))
+        mins = mins[first:last]
+        maxs = maxs[first:last]
+        indexes = np.arange(first, max(last, first))
+
+        if len(mins) > width:
+            edges = np.linspace(0, len(mins), width, endpoint=False).astype(np.int64)
+            mins = np.minimum.reduceat(mins, edges)
+            maxs = np.maximum.reduceat(maxs, edges)
+            indexes = indexes[edges]
+
+        return indexes * bin_len / self.frame_rate, mins, maxs
+
+    @staticmethod
+    def sidecar_name(input_file) -> str:
+        return f'{input_file}.peaks.npz'
+
+    def save(self, input_file) -> None:
+        """
+        Save the first level next to the source file
+        """
+
+        file_name = self.sidecar_name(input_file)
+        mins, maxs = self.levels[0]
+        with open(f'{file_name}.tmp', 'wb') as f:
+            np.savez_compressed(f,
+                                source=SilenceMap.source_stamp(input_file),
+                                mins=mins,
+                                maxs=maxs,
+                                frame_rate=self.frame_rate,
+                                base=self.base)
+        os.replace(f'{file_name}.tmp', file_name)
+
+    @classmethod
+    def load(cls, input_file):
+        """
+        Load the pyramid of the source file.
+        Returns None if there are no peaks or the source was changed.
+        """
+
+        try:
+            with np.load(cls.sidecar_name(input_file)) as data:
+                if not np.array_equal(data['source'],
+                                      SilenceMap.source_stamp(input_file)):
+                    return None
+
+                return cls(data['mins'], data['maxs'],
+                           frame_rate=int(data['frame_rate']),
+                           base=int(data['base']))
+
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import atexit
+import threading
+import multiprocessing
+from typing import Dict
+
+
+class ProgressChannel:
+    """
+    ProgressChannel sends progress events from the main process and
+    workers to listeners without polling the store. Events are put
+    to a queue without waiting, one dispatcher thread of the main
+    process takes them by batches and calls listeners with the list
+    of events (the GUI, the JSON progress, the log).
+    Worker processes get the queue when the pool is started
+    (see init_worker), the channel is pickled without it.
+    The queue is created by the first event and closed by close(),
+    so idle channels do not keep pipes open.
+
+    """
+
+    # the queue of the main process in worker processes
+    worker_queue = None
+
+    def __init__(self, batch_size=1000, timeout=0.5):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue = None
+        self.local = True
+        self.listeners = []
+        self.flushed = threading.Event()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def __getstate__(self) -> Dict:
+        # the queue is shared by inheritance only, listeners are local
+        state = self.__dict__.copy()
+        state['queue'] = None
+        state['local'] = False
+        state['listeners'] = []
+        state['flushed'] = None
+        state['thread'] = None
+        return state
+
+    def get_queue(self) -> multiprocessing.Queue:
+        """
+        Return the queue of the channel, it is created on the first call
+        """
+
+        if self.queue is None and self.local:
+            self.queue = multiprocessing.Queue()
+
+        return self.queue
+
+    @classmethod
+    def init_worker(cls, channel_queue) -> None:
+        """
+        Initializer of pool workers, it keeps the queue of the channel
+        """
+
+        cls.worker_queue = channel_queue
+
+    def add_listener(self, listener) -> None:
+        """
+        Add the function which is called with the list of events
+        """
+
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def start(self) -> None:
+        """
+        Start the dispatcher thread if it is not running
+        """
+
+        if self.get_queue() is not None and (self.thread is None or
+                                             not self.thread.is_alive()):
+            self.thread = threading.Thread(target=self.dispatcher, daemon=True)
+            self.thread.start()
+
+            # events are dispatched before the interpreter exits
+            atexit.register(self.close)
+
+    def put(self, event) -> bool:
+        """
+        Put the event to the queue with the time and the pid.
+        'main' is False for events of workers.
+        Returns False if the queue is not available (a worker
+        of a pool which was started without the channel).
+        """
+
+        event = {'time': time.time(), 'pid': os.getpid(),
+                 'main': os.getpid() == self.pid, **event}
+
+        if self.local and event['main']:
+            self.start()
+            self.queue.put(event)
+
+        elif self.worker_queue is not None:
+            self.worker_queue.put(event)
+
+        else:
+            return False
+
+        return True
+
+    def dispatcher(self) -> None:
+        """
+        Call listeners with batches of events until
+        the stop mark (None) is received
+        """
+
+        running = True
+        while running:
+            events = []
+            try:
+                events.append(self.queue.get(timeout=self.timeout))
+                # take the rest of the batch without waiting
+                while len(events) < self.batch_size:
+                    events.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            flush = False
+            batch = []
+            for event in events:
+                if event is None:
+                    running = False
+                elif event == 'flush':
+                    flush = True
+                else:
+                    batch.append(event)
+
+            if batch:
+                for listener in list(self.listeners):
+                    try:
+                        listener(batch)
+                    except Exception as err:
+                        print(f'Progress listener error({err}).')
+            if flush:
+                self.flushed.set()
+
+    def flush(self, timeout=10) -> None:
+        """
+        Wait until events which are in the queue are dispatched
+        """
+
+        if self.thread is not None and self.thread.is_alive():
+            self.flushed.clear()
+            self.queue.put('flush')
+            self.flushed.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Dispatch the rest of events, stop the dispatcher thread
+        and close the queue
+        """
+
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.thread = None
+        atexit.unregister(self.close)
+
+        if self.queue is not None:
+            self.queue.close()
+            self.queue.join_thread()
+            self.queue = None
@@ -0,0 +1,42 @@
+import json
+from typing import Dict
+
+
+class ProgressLog:
+    """
+    ProgressLog writes progress events to the log file as JSON lines.
+    It is a listener of ProgressChannel, so events of the main process
+    and workers come by batches from one thread, the file is opened
+    once and workers do not touch it.
+
+    """
+
+    def __init__(self, file_name='info.log'):
+        self.file_name = file_name
+        self.file = None
+
+    def __getstate__(self) -> Dict:
+        # the file is opened by the process which writes
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    def __call__(self, events) -> None:
+        self.write(events)
+
+    def write(self, events) -> None:
+        """
+        Write the batch of events
+        """
+
+        if self.file is None:
+            self.file = open(self.file_name, 'a')
+
+        self.file.write(''.join(json.dumps(event, default=str) + '\n'
+                                for event in events))
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
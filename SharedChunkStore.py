@@ -0,0 +1,247 @@
+import os
+import mmap
+import tempfile
+import contextlib
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List
+import pydub
+
+
+class SharedChunkStore:
+    """
+    SharedChunkStore keeps PCM data of the audio chunks in
+    shared memory blocks. The manager dict keeps only small
+    descriptors (block name, offset, length and audio params),
+    so the audio data is not pickled through the manager process.
+    Other keys (progress and so on) are stored in the manager dict as is.
+    Chunks which do not fit the memory budget are spilled to files
+    in 'spill_dir' and are read by mmap (see set).
+
+    """
+
+    def __init__(self, store=None, spill_dir=None):
+        if store is None:
+            store = multiprocessing.Manager().dict()
+        self.store = store
+        self.spill_dir = spill_dir
+
+        # workers must use the same resource tracker, otherwise
+        # blocks are unlinked when a worker process exits
+        resource_tracker.ensure_running()
+
+    def __setitem__(self, key, value) -> None:
+        self.set(key, value)
+
+    def set(self, key, value, spill=False) -> None:
+        """
+        Save the value, PCM data of the chunk is copied to shared
+        memory or to a file on disk if 'spill' is True
+        """
+
+        if isinstance(value, pydub.AudioSegment):
+            value = self.put(value, spill)
+            self.store[key] = value
+            # blocks are registered after the descriptor is saved,
+            # so release() never frees a block before it is used
+            for name, _, length in value['blocks']:
+                self.store[f'shm:{name}'] = length
+        else:
+            self.store[key] = value
+
+    def __getitem__(self, key):
+        value = self.store[key]
+        if self.is_chunk(value):
+            return self.load(value)
+        return value
+
+    def __delitem__(self, key) -> None:
+        del self.store[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.store
+
+    def get(self, key, default=None):
+        value = self.store.get(key, default)
+        if self.is_chunk(value):
+            return self.load(value)
+        return value
+
+    def keys(self) -> List:
+        return self.store.keys()
+
+    def clear(self) -> None:
+        self.release()
+        self.store.clear()
+
+    @staticmethod
+    def is_chunk(value) -> bool:
+        return isinstance(value, dict) and 'blocks' in value
+
+    def put(self, chunk, spill=False) -> Dict:
+        """
+        Copy PCM data of the chunk to a new shared memory block
+        (or to a file if 'spill' is True) and return its descriptor
+        """
+
+        data = chunk.raw_data
+        if spill:
+            # names of file blocks are absolute paths
+            fd, name = tempfile.mkstemp(prefix='chunk_', suffix='.pcm',
+                                        dir=self.spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data or b'\0')
+        else:
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(len(data), 1))
+            block.buf[:len(data)] = data
+            block.close()
+            name = block.name
+
+        return {'blocks': [(name, 0, len(data))],
+                'frame_rate': chunk.frame_rate,
+                'sample_width': chunk.sample_width,
+                'channels': chunk.channels}
+
+    def load(self, descriptor) -> pydub.AudioSegment:
+        """
+        Copy PCM data from shared memory blocks to a new AudioSegment
+        """
+
+        with self.attach(descriptor) as views:
+            data = b''.join(views)
+
+        return pydub.AudioSegment(data=data,
+                                  frame_rate=descriptor['frame_rate'],
+                                  sample_width=descriptor['sample_width'],
+                                  channels=descriptor['channels'])
+
+    @contextlib.contextmanager
+    def attach(self, descriptor):
+        """
+        Attach to shared memory blocks of the descriptor
+        and yield memoryviews of PCM data without copying.
+        Views must not be used after exit.
+        """
+
+        blocks = {}
+        buffers = {}
+        views = []
+        try:
+            for name, offset, length in descriptor['blocks']:
+                if name not in blocks:
+                    if os.path.isabs(name):
+                        with open(name, 'rb') as f:
+                            blocks[name] = mmap.mmap(f.fileno(), 0,
+                                                     access=mmap.ACCESS_READ)
+                        buffers[name] = memoryview(blocks[name])
+                    else:
+                        blocks[name] = shared_memory.SharedMemory(name=name)
+                        buffers[name] = blocks[name].buf
+                views.append(buffers[name][offset:offset + length])
+            yield views
+
+        finally:
+            for view in views:
+                view.release()
+            for name, block in blocks.items():
+                if os.path.isabs(name):
+                    buffers[name].release()
+                block.close()
+
+    @contextlib.contextmanager
+    def open(self, key):
+        """
+        Yield the chunk as AudioSegment.
+        If the chunk is one shared memory block, AudioSegment
+        uses it without copying (zero-copy view for reading only).
+        """
+
+        descriptor = self.store[key]
+        with self.attach(descriptor) as views:
+            if len(views) == 1:
+                data = views[0]
+            else:
+                data = b''.join(views)
+
+            yield pydub.AudioSegment(data=data,
+                                     frame_rate=descriptor['frame_rate'],
+                                     sample_width=descriptor['sample_width'],
+                                     channels=descriptor['channels'])
+
+    @staticmethod
+    def slice_blocks(blocks, start, end) -> List:
+        """
+        Slice the list of blocks by bytes positions
+        """
+
+        result = []
+        position = 0
+        for name, offset, length in blocks:
+            first = max(start - position, 0)
+            last = min(end - position, length)
+            if first < last:
+                result.append((name, offset + first, last - first))
+            position += length
+
+        return result
+
+    def move_tail(self, key1, key2, position) -> None:
+        """
+        Move data of the chunk 'key1' after 'position' ms
+        to the beginning of the chunk 'key2'. Only descriptors
+        are changed, PCM data is not copied.
+        """
+
+        descriptor1 = self.store[key1]
+        descriptor2 = self.store[key2]
+
+        frame_width = descriptor1['sample_width'] * descriptor1['channels']
+        length = sum(block[2] for block in descriptor1['blocks'])
+        split = int(position * (descriptor1['frame_rate'] / 1000.0))
+        split = min(split * frame_width, length)
+
+        tail = self.slice_blocks(descriptor1['blocks'], split, length)
+        descriptor1['blocks'] = self.slice_blocks(
+            descriptor1['blocks'], 0, split)
+        descriptor2['blocks'] = tail + descriptor2['blocks']
+
+        # the tail is referenced by the second chunk first,
+        # so the blocks are always referenced by any descriptor
+        self.store[key2] = descriptor2
+        self.store[key1] = descriptor1
+
+    def release(self, key=None) -> None:
+        """
+        Remove the chunk descriptor and free shared memory blocks
+        which are not used by other chunks.
+        Without the key all chunks and blocks are freed.
+        """
+
+        if key is not None:
+            self.store.pop(key, None)
+
+        items = self.store.items()
+        used = set()
+        if key is not None:
+            for _, value in items:
+                if self.is_chunk(value):
+                    used.update(name for name, _, _ in value['blocks'])
+
+        for item_key, value in items:
+            if isinstance(item_key, str) and item_key.startswith('shm:'):
+                if item_key[4:] in used:
+                    continue
+                try:
+                    if os.path.isabs(item_key[4:]):
+                        os.remove(item_key[4:])
+                    else:
+                        block = shared_memory.SharedMemory(name=item_key[4:])
+                        block.close()
+                        block.unlink()
+                except FileNotFoundError:
+                    pass
+                self.store.pop(item_key, None)
+
+            elif key is None and self.is_chunk(value):
+                self.store.pop(item_key, None)
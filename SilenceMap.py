@@ -0,0 +1,176 @@
+import os
+import zipfile
+import numpy as np
+import pydub
+from typing import Dict
+
+
+class SilenceMap:
+    """
+    SilenceMap is a compact index of loudness of the audio file:
+    the energy envelope with 'resolution' ms steps (0.5 dB levels
+    in uint8) and the table of silent intervals (start, end ms,
+    min and mean dBFS). It is saved next to the source file
+    ('<file>.silence.npz') and is valid while the size and the
+    modification time of the source are the same, so splits with
+    other settings are planned without decoding the audio.
+
+    """
+
+    def __init__(self, levels, resolution=10, silences=None,
+                 silence_len=None, silence_thresh=None):
+        self.levels = levels
+        self.resolution = resolution
+        self.energy = self.levels_to_energy(levels)
+        self.silence_len = silence_len
+        self.silence_thresh = silence_thresh
+        self.set_silences(np.zeros((0, 2), dtype=np.int64)
+                          if silences is None else silences)
+
+    @staticmethod
+    def energy_to_levels(energy) -> np.ndarray:
+        """
+        Mean squares (relative to the max amplitude) to 0.5 dB levels,
+        255 is 0 dBFS, 0 is -127.5 dBFS and digital silence
+        """
+
+        with np.errstate(divide='ignore'):
+            db = 10 * np.log10(energy)
+
+        return np.clip(np.round(2 * db) + 255, 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def levels_to_energy(levels) -> np.ndarray:
+        energy = 10 ** ((levels.astype(np.float32) - 255) / 20)
+        energy[levels == 0] = 0
+
+        return energy.astype(np.float32)
+
+    @classmethod
+    def from_energy_map(cls, energy_map, resolution=10):
+        """
+        Make the map from mean squares of every millisecond
+        """
+
+        frames = -(-len(energy_map) // resolution)
+        padded = np.zeros(frames * resolution, dtype=np.float64)
+        padded[:len(energy_map)] = energy_map
+        counts = np.full(frames, resolution)
+        if frames:
+            counts[-1] = len(energy_map) - (frames - 1) * resolution
+
+        energy = padded.reshape(frames, resolution).sum(axis=1) / counts
+
+        return cls(cls.energy_to_levels(energy), resolution)
+
+    def __len__(self) -> int:
+        """
+        Length of the map in ms
+        """
+
+        return len(self.levels) * self.resolution
+
+    def dBFS(self, start=0, end=None) -> float:
+        """
+        Loudness of the interval (ms)
+        """
+
+        first = int(start // self.resolution)
+        last = len(self.levels) if end is None else int(-(-end // self.resolution))
+        energy = self.energy[first:last]
+        if not len(energy) or not energy.any():
+            return -float('inf')
+
+        return pydub.utils.ratio_to_db(float(energy.mean()) ** 0.5)
+
+    def set_silences(self, silences, silence_len=None,
+                     silence_thresh=None) -> None:
+        """
+        Keep silent intervals (ms) with their min and mean dBFS
+        """
+
+        self.silences = np.asarray(silences, dtype=np.int64).reshape(-1, 2)
+        if silence_len is not None:
+            self.silence_len = silence_len
+            self.silence_thresh = silence_thresh
+
+        self.min_dBFS = np.zeros(len(self.silences), dtype=np.float32)
+        self.mean_dBFS = np.zeros(len(self.silences), dtype=np.float32)
+        for i, (start, end) in enumerate(self.silences):
+            first = start // self.resolution
+            last = max(-(-end // self.resolution), first + 1)
+            self.min_dBFS[i] = (int(self.levels[first:last].min()) - 255) / 2
+            self.mean_dBFS[i] = self.dBFS(start, end)
+
+    def envelope(self, start, end, max_amplitude=32768) -> Dict:
+        """
+        Return the envelope of the interval (ms) with 1 ms steps
+        like SmartAudioSplitter.calc_loudness_envelope does
+        """
+
+        first = int(start // self.resolution)
+        last = int(-(-end // self.resolution))
+        energy = np.repeat(self.energy[first:last].astype(np.float64),
+                           self.resolution)
+        offset = int(start - first * self.resolution)
+        energy = energy[offset:offset + int(end - start)]
+
+        cumulative = np.zeros(len(energy) + 1)
+        np.cumsum(energy * max_amplitude ** 2, out=cumulative[1:])
+
+        return {'energy': cumulative,
+                'samples': np.arange(len(energy) + 1),
+                'max_amplitude': max_amplitude}
+
+    @staticmethod
+    def sidecar_name(input_file) -> str:
+        return f'{input_file}.silence.npz'
+
+    @staticmethod
+    def source_stamp(input_file) -> np.ndarray:
+        stat = os.stat(input_file)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def save(self, input_file) -> None:
+        """
+        Save the map next to the source file
+        """
+
+        file_name = self.sidecar_name(input_file)
+        with open(f'{file_name}.tmp', 'wb') as f:
+            np.savez_compressed(
+                f,
+                source=self.source_stamp(input_file),
+                levels=self.levels,
+                resolution=self.resolution,
+                silences=self.silences,
+                min_dBFS=self.min_dBFS,
+                mean_dBFS=self.mean_dBFS,
+                silence_len=np.nan if self.silence_len is None else self.silence_len,
+                silence_thresh=(np.nan if self.silence_thresh is None
+                                else self.silence_thresh))
+        os.replace(f'{file_name}.tmp', file_name)
+
+    @classmethod
+    def load(cls, input_file):
+        """
+        Load the map of the source file.
+        Returns None if there is no map or the source was changed.
+        """
+
+        try:
+            with np.load(cls.sidecar_name(input_file)) as data:
+                if not np.array_equal(data['source'],
+                                      cls.source_stamp(input_file)):
+                    return None
+
+                silence_len = float(data['silence_len'])
+                silence_thresh = float(data['silence_thresh'])
+                return cls(data['levels'],
+                           resolution=int(data['resolution']),
+                           silences=data['silences'],
+                           silence_len=None if np.isnan(silence_len) else int(silence_len),
+                           silence_thresh=None if np.isnan(silence_thresh) else silence_thresh)
+
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
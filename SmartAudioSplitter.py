@@ -1,10 +1,33 @@
+import os
+import sys
+import json
+import glob
+import argparse
 import time
+import numpy as np
 import pydub
-import re
+import struct
 import subprocess
+import tempfile
+import threading
+import itertools
+import contextlib
 import concurrent.futures
+import heapq
 import multiprocessing
+import multiprocessing.managers
+import multiprocessing.resource_tracker
 from typing import List, Dict, Tuple
+from SharedChunkStore import SharedChunkStore
+from Mp3Index import Mp3Index
+from ProgressLog import ProgressLog
+from ProgressChannel import ProgressChannel
+from SilenceMap import SilenceMap
+from PeakPyramid import PeakPyramid
+from MediaInfoCache import MediaInfoCache
+from JobManifest import JobManifest
+from CancelToken import CancelToken, JobCancelled
+from VoiceActivityDetector import VoiceActivityDetector
 
 
 class SmartAudioSplitter:
@@ -17,11 +40,17 @@ class SmartAudioSplitter:
 
     def __init__(self,
                  full_filename, add_pause=True, pause_len=2000,
-                 silence_len=500, level_dBFS='calc',
+                 silence_len=500, level_dBFS='auto',
                  multiprocessing_on=True,
                  n_split=4, n_jobs=2, how='split_by_silence',
                  out_filename='part', format_='mp3', bitrate='128k',
-                 tags=None, log_to_file=False, store=None):
+                 tags=None, log_to_file=False, store=None, pool=None,
+                 streaming=False, lossless=False, pcm_cache=None,
+                 part_duration=None, json_progress=False,
+                 metrics_file=None, channel=None, tolerance=None,
+                 silence_index=False, media_info=None, n_encoders=None,
+                 max_memory=None, resume=False, cancel_token=None,
+                 analysis_rate=8000, spill_dir=None):
 
         self.full_filename = full_filename
         self.add_pause = add_pause
@@ -31,85 +60,642 @@ class SmartAudioSplitter:
         self.n_split = n_split
         self.multiprocessing_on = multiprocessing_on
         self.n_jobs = n_jobs
+        self.n_encoders = n_encoders or n_jobs
+        # the budget (bytes) of decoded parts which are in flight
+        self.max_memory = max_memory
+        # temp files of spilled parts and of search regions of the streaming
+        # mode (None is the default temp dir, it can be in memory)
+        self.spill_dir = spill_dir
         self.how = how
         self.out_filename = out_filename
         self.format_ = format_
         self.bitrate = bitrate
         self.tags = tags
         self.log_to_file = log_to_file
+        self.streaming = streaming
+        self.lossless = lossless
+        self.pcm_cache = pcm_cache
+        self.part_duration = part_duration
+        self.tolerance = tolerance
+        self.silence_index = silence_index
+        # silence is detected on the mono stream of about this
+        # frame rate (None is the source format)
+        self.analysis_rate = analysis_rate
+
+        # with 'resume' the job manifest is kept next to parts,
+        # exported parts are skipped by the restarted job
+        self.resume = resume
+        self.manifests = {}
+
+        # the job is cancelled by the token (see cancel),
+        # it can be shared with the GUI
+        self.cancel_token = cancel_token
+        self.cancel_token_owner = cancel_token is None
+
+        # parameters of files are probed once,
+        # the cache can be shared with the GUI
+        self.media_info = MediaInfoCache() if media_info is None else media_info
+        self.plans = {}
+        self.json_progress = json_progress
+        self.metrics_file = metrics_file
+        self.counters = {}
+        self.progress_maximum = None
+        self.progress_tick = 0
+        # errors of tasks of the last run (the CLI exit code)
+        self.errors = 0
+
+        # progress events go to listeners by the channel,
+        # it can be shared by many instances like the pool
+        self.channel = ProgressChannel() if channel is None else channel
+        self.channel_owner = channel is None
+
+        if json_progress:
+            self.channel.add_listener(self.print_progress_events)
+
+        # log_to_file can be the name of the log file
+        self.log = None
+        if log_to_file:
+            self.log = ProgressLog(log_to_file if isinstance(log_to_file, str)
+                                   else 'info.log')
+            self.channel.add_listener(self.log)
+        self.audio_extensions = ('.mp3', '.wav', '.m4b', '.m4a', '.aac',
+                                 '.flac', '.ogg', '.opus', '.wma')
         self.version = 'SmartAudioSplitter v1.0 2024 https://github.com/Tikhvinskiy/Smart-audio-splitter.git'
 
         if store is None:
             if self.multiprocessing_on:
-                self.store = multiprocessing.Manager().dict()
+                self.store = SharedChunkStore(spill_dir=spill_dir)
             else:
                 self.store = dict()
         else:
             self.store = store
 
+        # the pool can be shared by many instances,
+        # the instance shuts down only its own pool
+        self.pool = pool
+        self.pool_owner = pool is None
+
+        # threads of ffmpeg encoders (see get_encoders)
+        self.encoders = None
+
+    def __getstate__(self) -> Dict:
+        # pools are not sent to the workers
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['encoders'] = None
+        state['manifests'] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def get_pool(self, n_jobs) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        Return the long-lived worker pool. It is created once and
+        reused by all phases of processing and by next runs.
+        """
+
+        # only the pool is replaced, the log and the cancel token
+        # are kept for the run (see close)
+        if (self.pool_owner and self.pool is not None and
+                self.pool._max_workers != n_jobs):
+            self.pool.shutdown()
+            self.pool = None
+
+        if self.pool is None:
+            # workers must share the resource tracker of this process
+            multiprocessing.resource_tracker.ensure_running()
+
+            # workers put progress events to the queue of the channel
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=ProgressChannel.init_worker,
+                initargs=(self.channel.get_queue(),))
+            self.pool_owner = True
+            self.channel.start()
+
+        return self.pool
+
+    def close(self) -> None:
+        """
+        Shut down the worker pool and the progress channel
+        if the instance owns them, encoders and write the rest of the log
+        """
+
+        if self.pool_owner and self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+        if self.encoders is not None:
+            self.encoders.shutdown()
+            self.encoders = None
+
+        if self.cancel_token_owner and self.cancel_token is not None:
+            self.cancel_token.close()
+            self.cancel_token = None
+
+        if self.channel_owner:
+            self.channel.close()
+        else:
+            self.channel.flush()
+
+        if self.log is not None:
+            self.channel.remove_listener(self.log)
+            self.log.close()
+
     def run(self) -> None:
         """
-        Run splitting with the specified parameters
+        Run splitting with the specified parameters.
+        If full_filename is a directory or a glob pattern,
+        all found files are split in the batch mode.
+        The job can be cancelled by cancel() from other threads.
         """
 
-        if self.multiprocessing_on:
+        self.clear_metrics(self.store)
+        self.get_cancel_token().reset()
+        self.errors = 0
+
+        try:
+            if self.is_batch(self.full_filename):
+                self.run_batch(self.find_input_files(self.full_filename))
+            else:
+                self.run_file(self.full_filename, self.out_filename, self.store)
+
+        except JobCancelled:
+            print(m := '\rThe job is cancelled', end=' ' * 20)
+            self.progress(self.store, message=m[1:], warning=True)
+
+            # free shared memory of unsaved parts
+            if isinstance(self.store, SharedChunkStore):
+                self.store.release()
+
+        if self.metrics_file:
+            with open(self.metrics_file, 'w') as f:
+                f.write(self.metrics_text(self.store))
+
+        # listeners get all events of the run
+        self.channel.flush()
+
+    def run_file(self, input_file, out_filename, store) -> None:
+        """
+        Split one file with the specified parameters
+        """
+
+        n, how = self.start_job(input_file, out_filename, store)
+
+        if self.lossless and self.can_cut_losslessly(input_file, store):
+            self.lossless_pipeline(
+                input_file=input_file,
+                n=n,
+                out_filename=out_filename,
+                format_=self.format_,
+                tags=self.tags,
+                store=store)
+
+        elif self.streaming:
+            with self.measure(store, 'stream', 0, input_file):
+                self.streaming_pipeline(
+                    input_file=input_file,
+                    n=n,
+                    add_pause=self.add_pause,
+                    pause_len=self.pause_len,
+                    silence_len=self.silence_len,
+                    how=how,
+                    out_filename=out_filename,
+                    format_=self.format_,
+                    bitrate=self.bitrate,
+                    tags=self.tags,
+                    store=store)
+
+        elif self.multiprocessing_on:
             self.multiprocessing_split_pool(
-                input_file=self.full_filename,
-                n=self.n_split,
+                input_file=input_file,
+                n=n,
                 add_pause=self.add_pause,
                 pause_len=self.pause_len,
                 silence_len=self.silence_len,
                 n_jobs=self.n_jobs,
-                how=self.how,
-                out_filename=self.out_filename,
+                how=how,
+                out_filename=out_filename,
                 format_=self.format_,
                 bitrate=self.bitrate,
                 tags=self.tags,
-                store=self.store)
+                store=store)
 
         else:
             self.processing_pipeline(
-                input_file=self.full_filename,
-                n=self.n_split,
+                input_file=input_file,
+                n=n,
                 add_pause=self.add_pause,
                 pause_len=self.pause_len,
                 silence_len=self.silence_len,
-                how=self.how,
-                out_filename=self.out_filename,
+                how=how,
+                out_filename=out_filename,
                 format_=self.format_,
                 bitrate=self.bitrate,
                 tags=self.tags,
-                store=self.store)
+                store=store)
+
+    def is_batch(self, path) -> bool:
+        """
+        A directory or a glob pattern is split in the batch mode
+        """
+
+        return os.path.isdir(path) or (not os.path.isfile(path) and
+                                       glob.has_magic(path))
+
+    def find_input_files(self, path) -> List[str]:
+        """
+        Find audio files in the directory or by the glob pattern
+        """
+
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in os.listdir(path)
+                     if os.path.splitext(name)[1].lower() in self.audio_extensions]
+        else:
+            files = glob.glob(path, recursive=True)
+
+        return sorted(file for file in files if os.path.isfile(file))
+
+    def run_batch(self, input_files) -> None:
+        """
+        Split many files with one worker pool.
+        Outputs are saved to subdirectories named by input files:
+        <dir of out_filename>/<input name>/<out_filename>_<n>.
+        Files are balanced by duration, the longest files start first.
+
+        - Get parameters of all files
+        - Calc the graph of tasks of all files
+        - Run the graph by the pool
+
+        """
+        store = self.store
+
+        # Get parameters of all files
+        parameters = {}
+        for i, input_file in enumerate(input_files, start=1):
+            print(m := (f'\rProcessing file {i} of {len(input_files)} '
+                        f'(get parameters)'), end=' ' * 20)
+            self.progress(store, message=m[1:])
+            try:
+                parameters[input_file] = self.get_parameters(input_file)
+            except Exception as err:
+                self.errors += 1
+                print(f'{input_file}. An error was raised({err}).\n')
+                self.progress(store, message=f'{input_file}: {err}', warning=True)
+
+        input_files = sorted(
+            parameters,
+            key=lambda input_file: self.calc_duration(parameters[input_file]),
+            reverse=True)
+
+        # Outputs to subdirectories
+        out_dir, out_name = os.path.split(self.out_filename)
+        out_filenames = {}
+        for input_file in input_files:
+            name = os.path.splitext(os.path.basename(input_file))[0]
+            subdir = os.path.join(out_dir, name)
+            suffix = 1
+            while subdir in out_filenames.values():
+                suffix += 1
+                subdir = os.path.join(out_dir, f'{name}_{suffix}')
+            out_filenames[input_file] = subdir
+        for input_file, subdir in out_filenames.items():
+            os.makedirs(subdir, exist_ok=True)
+            out_filenames[input_file] = os.path.join(subdir, out_name)
+
+        if not self.multiprocessing_on:
+            for input_file in input_files:
+                self.run_file(input_file, out_filenames[input_file], store)
+            return
+
+        pool = self.get_pool(self.n_jobs)
+        graph = {}
+        submits = {}
+        free_parts = {}
+        sizes = {}
+        for rank, input_file in enumerate(input_files):
+            if self.streaming or self.lossless:
+                # files are split as a whole by workers
+                graph[('file', 1, rank)] = []
+                submits[rank] = (
+                    lambda task, input_file=input_file: pool.submit(
+                        self.multiprocessing_task,
+                        (store, 'file', 0, input_file, time.time()),
+                        'multiprocessing_task_run_file', input_file,
+                        out_filenames[input_file]))
+                free_parts[rank] = None
+                continue
+
+            n, how = self.start_job(input_file, out_filenames[input_file],
+                                    store, parameters[input_file])
+
+            file_graph, submits[rank], free_parts[rank], file_sizes = self.calc_pool_tasks(
+                input_file, n, self.add_pause, self.pause_len,
+                self.silence_len, how, out_filenames[input_file],
+                self.format_, self.bitrate, self.tags, store, pool,
+                parameters=parameters[input_file], file_key=rank)
+            graph.update(file_graph)
+            sizes.update(file_sizes)
+
+        def submit(task):
+            return submits[task[2]](task)
+
+        def free_part(task):
+            if free_parts[task[2]] is not None:
+                free_parts[task[2]](task)
+
+        # save progress
+        self.progress(store, set_max=True, maximum=len(graph))
+
+        self.run_task_graph(graph, submit, self.n_jobs, store,
+                            on_done=free_part, n_encoders=self.n_encoders,
+                            sizes=sizes)
+
+        # free shared memory after saving
+        if isinstance(store, SharedChunkStore):
+            store.release()
+
+        self.progress(store, message='Done')
+
+    def calc_split_settings(self, input_file, store,
+                            parameters=None) -> Tuple[int, str]:
+        """
+        Calc the number of parts of the file and how pipelines split it.
+        Parts of 'split_by_duration' and of 'split_by_silence' with
+        the silence index (or 'resume') are planned by the silence map
+        of the whole file, parts of 'split_by_vad' with 'resume' are
+        planned by search regions, so pipelines cut them as 'raw_split'.
+        """
+
+        planned = (self.how == 'split_by_duration' or
+                   self.how == 'split_by_silence' and
+                   (self.silence_index or self.resume) or
+                   self.how == 'split_by_vad' and self.resume)
+        if parameters is None and (planned or self.part_duration):
+            parameters = self.get_parameters(input_file)
+
+        n = self.n_split
+        if self.part_duration:
+            n = self.calc_n_split(parameters)
+
+        if not planned:
+            return n, self.how
+
+        self.plans[input_file] = self.plan_parts(input_file, store,
+                                                 parameters, n)
+
+        return len(self.plans[input_file]), 'raw_split'
+
+    def start_job(self, input_file, out_filename, store,
+                  parameters=None) -> Tuple[int, str]:
+        """
+        Calc split settings of the file. With 'resume' parts are
+        taken from the job manifest of the previous run with the same
+        source and settings (its exported parts are skipped),
+        otherwise parts are planned and the new manifest is saved.
+        """
+
+        if not self.resume:
+            return self.calc_split_settings(input_file, store, parameters)
+
+        if parameters is None:
+            parameters = self.get_parameters(input_file)
+
+        settings = {'how': self.how, 'n_split': self.n_split,
+                    'part_duration': self.part_duration,
+                    'tolerance': self.tolerance,
+                    'silence_len': self.silence_len,
+                    'level_dBFS': self.level_dBFS,
+                    'add_pause': self.add_pause, 'pause_len': self.pause_len,
+                    'format': self.format_, 'bitrate': self.bitrate,
+                    'tags': self.tags, 'lossless': self.lossless}
+
+        manifest = JobManifest.load(out_filename, input_file, settings)
+        if manifest is None:
+            n, how = self.calc_split_settings(input_file, store, parameters)
+            manifest = JobManifest(out_filename, input_file, settings,
+                                   self.calc_parts_times(
+                                       input_file, n, self.calc_duration(parameters)))
+            manifest.save()
+
+        else:
+            self.plans[input_file] = manifest.parts
+            how = 'raw_split'
+            print(m := (f'\rResume {os.path.basename(input_file)} '
+                        f'({len(manifest.done)} of {len(manifest.parts)} '
+                        f'parts are exported)'), end=' ' * 20)
+            self.progress(store, message=m[1:])
+
+        self.manifests[out_filename] = manifest
+
+        return len(manifest.parts), how
+
+    def done_parts(self, out_filename) -> set:
+        """
+        Numbers of parts exported by the previous run of the job
+        """
+
+        manifest = self.manifests.get(out_filename)
+
+        return set() if manifest is None else set(manifest.done)
+
+    def checkpoint(self, out_filename, n) -> None:
+        """
+        Record the exported part in the job manifest
+        """
+
+        manifest = self.manifests.get(out_filename)
+        if manifest is not None:
+            manifest.add_part(n)
+
+    def get_cancel_token(self) -> CancelToken:
+        if self.cancel_token is None:
+            self.cancel_token = CancelToken()
+            self.cancel_token_owner = True
+
+        return self.cancel_token
+
+    def cancel(self) -> None:
+        """
+        Cancel the running job, it is stopped between phases
+        and inside long scans, exported parts are kept
+        """
+
+        self.get_cancel_token().cancel()
+
+    def check_cancel(self) -> None:
+        if self.cancel_token is not None:
+            self.cancel_token.check()
+
+    def can_cut_losslessly(self, input_file, store) -> bool:
+        """
+        Parts can be cut without re-encoding only for 'raw_split'
+        and planned parts (the split points are known before cutting)
+        without pauses to the same format as the input file
+        """
+
+        in_format = os.path.splitext(input_file)[1][1:].lower()
+        if ((self.how == 'raw_split' or input_file in self.plans) and
+                not self.add_pause and
+                in_format == self.format_):
+            return True
+
+        self.progress(store, warning=True,
+                      message=('Lossless cut is possible only for raw split '
+                               'without pauses to the same format. '
+                               'Parts are re-encoded.'))
+        return False
 
     def get_parameters(self, input_file) -> Dict:
         """
-        Trying to get parameters of the audio file.
-        If pydub is failed, we use 'ffprobe' directly
+        Get parameters of the audio file from the cache
+        of media info, the file is probed once
         """
 
-        try:
-            parameters = pydub.utils.mediainfo(input_file)
+        with self.measure(self.store, 'probe', 0, input_file):
+            return self.media_info.get(input_file, self.probe_parameters)
+
+    def probe_parameters(self, input_file) -> Dict:
+        """
+        Get parameters of the audio file: headers of MP3 and WAV
+        files are parsed without ffprobe, other files (and MP3/WAV
+        which are not parsed) are probed by ffprobe
+        """
 
-        except Exception as err:
+        extension = os.path.splitext(input_file)[1].lower()
+        parameters = None
+        try:
+            if extension == '.mp3':
+                parameters = Mp3Index.probe(input_file)
+            elif extension == '.wav':
+                parameters = self.probe_wav(input_file)
+        except (struct.error, ValueError) as err:
             print(f'{err}\nTrying ffprobe')
-            try:
-                args = ('ffprobe',
-                        '-show_entries',
-                        'format=duration',
-                        '-i',
-                        input_file)
-                popen = subprocess.Popen(args, stdout=subprocess.PIPE)
-                popen.wait()
-                output = popen.stdout.read()
-                duration = re.findall(
-                    r'duration=([\d\.]+)', str(output))[0]
-                parameters = {'ffprobe_duration': duration}
 
-            except Exception as err:
-                raise err
+        if parameters is None:
+            parameters = self.probe_ffprobe(input_file)
 
         return parameters
 
+    def probe_wav(self, input_file) -> Dict:
+        """
+        Get parameters of the WAV file from its header.
+        Returns None if it is not a RIFF/WAVE file.
+        """
+
+        size = os.path.getsize(input_file)
+        fmt = None
+        data_size = None
+        with open(input_file, 'rb') as f:
+            header = f.read(12)
+            if header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+                return None
+
+            while len(chunk := f.read(8)) == 8:
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHIIHH', f.read(16))
+                    f.seek(chunk_size - 16 + chunk_size % 2, 1)
+                elif chunk_id == b'data':
+                    # the size of streamed and RF64 files is not in the header
+                    data_size = min(chunk_size, size - f.tell())
+                    break
+                else:
+                    f.seek(chunk_size + chunk_size % 2, 1)
+
+        if fmt is None or data_size is None or not fmt[3]:
+            return None
+
+        format_tag, channels, sample_rate, byte_rate, _, bits = fmt
+        if bits == 8:
+            codec_name = 'pcm_u8'
+        elif format_tag == 3:
+            codec_name = f'pcm_f{bits}le'
+        else:
+            codec_name = f'pcm_s{bits}le'
+
+        return {'format_name': 'wav', 'codec_name': codec_name,
+                'duration': f'{data_size / byte_rate:.6f}',
+                'sample_rate': str(sample_rate),
+                'channels': str(channels),
+                'bit_rate': str(byte_rate * 8)}
+
+    def probe_ffprobe(self, input_file) -> Dict:
+        """
+        Get parameters of the audio file by one ffprobe call
+        which returns only the needed fields as JSON
+        """
+
+        args = ('ffprobe', '-v', 'error',
+                '-select_streams', 'a:0',
+                '-show_entries',
+                ('stream=codec_name,sample_rate,channels,bit_rate:'
+                 'format=format_name,duration,bit_rate'),
+                '-of', 'json',
+                input_file)
+        result = subprocess.run(args, capture_output=True)
+        if result.returncode:
+            raise RuntimeError(f'ffprobe error: {result.stderr.decode()}')
+
+        info = json.loads(result.stdout)
+        parameters = {}
+        for stream in info.get('streams', [])[:1]:
+            parameters.update(stream)
+        # the duration and the bitrate of the file are used
+        parameters.update(info.get('format', {}))
+
+        if 'duration' not in parameters:
+            raise RuntimeError(f'ffprobe error: no duration of {input_file}')
+
+        return {key: str(value) for key, value in parameters.items()
+                if value != 'N/A'}
+
+    def prepare_pcm_cache(self, input_file, parameters) -> None:
+        """
+        Decode the file to the PCM cache if the cache is used
+        """
+
+        if self.pcm_cache is not None:
+            frame_rate, channels = self.get_audio_format(parameters)
+            self.pcm_cache.get(input_file, frame_rate, channels)
+
+    def load_chunk(self, input_file, start_second,
+                   duration) -> pydub.AudioSegment:
+        """
+        Load a chunk of audio data from the PCM cache
+        or decode it from the file
+        """
+
+        if self.pcm_cache is not None and self.pcm_cache.entry(input_file):
+            chunk = self.pcm_cache.load(input_file,
+                                        start_second=start_second,
+                                        duration=duration)
+        else:
+            chunk = pydub.AudioSegment.from_file(input_file,
+                                                 start_second=start_second,
+                                                 duration=duration)
+
+        self.count('bytes_decoded', len(chunk.raw_data))
+
+        return chunk
+
+    def calc_duration(self, parameters) -> float:
+        """
+        Get duration of audio data from parameters
+        """
+
+        return float(parameters['duration'])
+
+    def calc_n_split(self, parameters) -> int:
+        """
+        Calc number of parts by the target part duration (seconds)
+        """
+
+        return max(1, round(self.calc_duration(parameters) / self.part_duration))
+
     def calc_list_of_parts(self, n, duration) -> List:
         """
         Calc time intervals to divide into files
@@ -125,64 +711,973 @@ class SmartAudioSplitter:
 
         return chunkc_times
 
-    def detect_silence(self, chunk, min_silence_len=500,
-                       dBFS='calc', store=None) -> float:
+    def calc_parts_times(self, input_file, n, duration) -> List:
         """
-        Detect silence in the end of the chunk(last 80%) and return
-        middle of this silence time. This time uses for splitting.
+        Time intervals of parts: planned by the silence map
+        (see calc_split_settings) or equal intervals
+        """
+
+        if input_file in self.plans:
+            return self.plans[input_file]
+
+        return self.calc_list_of_parts(n, duration)
 
+    def calc_energy_map(self, input_file, parameters,
+                        start_second=0, duration=None) -> np.ndarray:
+        """
+        Decode the file (or its segment) by blocks and return
+        the mean square of samples of every millisecond
+        relative to the max amplitude (float32).
+        The file is decoded to the analysis format by ffmpeg.
         """
-        silence = []
-        chunk_len = len(chunk)
-        time_calc_silence = len(chunk)
 
-        if dBFS == 'calc':
-            silence_thresh = int(chunk.dBFS)
-            silence_thresh += silence_thresh // 2
+        frame_rate, channels = self.get_analysis_format(parameters)
+        energy_map = [self.calc_block_energy(data, frame_rate, channels)
+                      for data in self.decode_stream(input_file, frame_rate, channels,
+                                                     start_second=start_second,
+                                                     duration=duration)]
+
+        if not energy_map:
+            return np.zeros(0, dtype=np.float32)
 
-        iteration = 0
-        while not len(silence):
+        return np.concatenate(energy_map)
+
+    def calc_block_energy(self, data, frame_rate, channels) -> np.ndarray:
+        """
+        The mean square of every millisecond of the decoded block
+        """
+
+        block = self.analysis_chunk(pydub.AudioSegment(data=data, sample_width=2,
+                                                       frame_rate=frame_rate,
+                                                       channels=channels))
+        envelope = self.calc_loudness_envelope(block)
+        energy = np.diff(envelope['energy'])
+        samples = np.maximum(np.diff(envelope['samples']), 1)
+
+        return (energy / samples /
+                block.max_possible_amplitude ** 2).astype(np.float32)
+
+    def calc_file_energy_map(self, input_file, parameters,
+                             segment_len=600) -> np.ndarray:
+        """
+        Calc the energy map of the whole file, in the multiprocessing
+        mode segments of the file are decoded by the pool
+        """
+
+        duration = self.calc_duration(parameters)
+        if not self.multiprocessing_on or duration <= segment_len:
+            return self.calc_energy_map(input_file, parameters)
+
+        # segments are multiples of decoded blocks (10 s)
+        n_segments = max(self.n_jobs, int(duration // segment_len))
+        segment_len = float(np.ceil(duration / n_segments / 10) * 10)
+
+        pool = self.get_pool(self.n_jobs)
+        futures = [pool.submit(self.calc_energy_map, input_file, parameters,
+                               start, segment_len)
+                   for start in np.arange(0, duration, segment_len)]
+
+        return np.concatenate([future.result() for future in futures])
+
+    def find_silences(self, energy_map, min_silence_len, silence_thresh,
+                      resolution=1, block_len=3_600_000) -> np.ndarray:
+        """
+        Find silent ranges [start, end] ms in the energy map:
+        windows of 'min_silence_len' ms with RMS not above
+        the threshold (dBFS, or an array of thresholds of windows
+        by values of the map). Values of the map are 'resolution' ms
+        long. Windows are calculated by blocks of 'block_len' ms.
+        """
 
-            if iteration > 2:
+        window_len = max(1, round(min_silence_len / resolution))
+        block_size = max(1, block_len // resolution)
+        threshold = (10 ** (np.asarray(silence_thresh, dtype=np.float64) / 10) *
+                     window_len)
+        last_start = len(energy_map) - window_len
+        silent_starts = []
+        for start in range(0, max(last_start + 1, 0), block_size):
+            end = min(start + block_size, last_start + 1)
+            cumulative = np.zeros(end - start + window_len)
+            np.cumsum(energy_map[start:end + window_len - 1],
+                      dtype=np.float64, out=cumulative[1:])
+            window = cumulative[window_len:] - cumulative[:-window_len]
+            window_threshold = threshold if threshold.ndim == 0 else threshold[start:end]
+            silent_starts.append(np.flatnonzero(window <= window_threshold) + start)
+
+        if not silent_starts:
+            return np.zeros((0, 2), dtype=np.int64)
+
+        silences = self.find_silent_ranges(np.concatenate(silent_starts),
+                                           window_len)
+
+        return np.array(silences, dtype=np.int64).reshape(-1, 2) * resolution
+
+    def find_quietest_window(self, energy_map, start, end,
+                             window_len, resolution=1) -> float:
+        """
+        Return the middle (ms) of the quietest window
+        between 'start' and 'end' ms
+        """
+
+        first, last = int(start // resolution), int(end // resolution)
+        window_len = max(1, round(window_len / resolution))
+        segment = energy_map[first:last]
+        if len(segment) <= window_len:
+            return (start + end) / 2
+
+        cumulative = np.concatenate(([0], np.cumsum(segment, dtype=np.float64)))
+        window = cumulative[window_len:] - cumulative[:-window_len]
+
+        return (first + int(np.argmin(window)) + window_len / 2) * resolution
+
+    def plan_split_points(self, energy_map, silences, target,
+                          tolerance, min_silence_len=500,
+                          resolution=1) -> List[float]:
+        """
+        Choose split points (ms) of the whole file at once:
+        the number of parts is the nearest to the target length,
+        all parts are close to the file length / number of parts.
+
+        Candidates are middles of silences. Where there is no silence,
+        the quietest window is a candidate with a penalty. Dynamic
+        programming picks candidates with the least sum of squared
+        deviations of parts; a part is not longer or shorter than
+        the mean length by more than the tolerance.
+
+        """
+        length = len(energy_map) * resolution
+        n = max(1, round(length / target))
+        if n == 1:
+            return []
+        target = length / n
+        tolerance = max(tolerance, 2 * min_silence_len)
+
+        points = silences.mean(axis=1) if len(silences) else np.zeros(0)
+        points = points[(points > 0) & (points < length)]
+        penalties = np.zeros(len(points))
+
+        # every half of the tolerance has a candidate
+        step = int(tolerance // 2)
+        fallback = []
+        for start in range(0, length, step):
+            end = min(start + step, length)
+            first, last = np.searchsorted(points, (start, end))
+            if first == last:
+                fallback.append(self.find_quietest_window(
+                    energy_map, start, end, min_silence_len, resolution))
+        if fallback:
+            points = np.concatenate((points, fallback))
+            penalties = np.concatenate((penalties,
+                                        np.full(len(fallback), (2 * tolerance) ** 2)))
+            order = np.argsort(points, kind='stable')
+            points, penalties = points[order], penalties[order]
+
+        points = np.concatenate(([0], points, [length]))
+        penalties = np.concatenate(([0], penalties, [0]))
+
+        best = np.full(len(points), np.inf)
+        best[0] = 0
+        previous = np.full(len(points), -1)
+        for j in range(1, len(points)):
+            first = np.searchsorted(points, points[j] - target - tolerance)
+            last = min(np.searchsorted(points, points[j] - target + tolerance,
+                                       side='right'), j)
+            if first >= last:
+                continue
+            costs = (best[first:last] +
+                     (points[j] - points[first:last] - target) ** 2)
+            k = int(np.argmin(costs))
+            best[j] = costs[k] + penalties[j]
+            previous[j] = first + k
+
+        if not np.isfinite(best[-1]):
+            return [target * i for i in range(1, n)]
+
+        split_points = []
+        j = previous[-1]
+        while j > 0:
+            split_points.append(float(points[j]))
+            j = previous[j]
+
+        return split_points[::-1]
+
+    def get_silence_map(self, input_file, parameters, store,
+                        energy_map=None) -> SilenceMap:
+        """
+        Return the silence map of the file. With 'silence_index'
+        the map is loaded from the file next to the source or it is
+        built by one decoding pass (or from 'energy_map')
+        and saved for next runs.
+        """
+
+        if self.silence_index:
+            silence_map = SilenceMap.load(input_file)
+            if silence_map is not None:
+                return silence_map
+
+        if energy_map is None:
+            energy_map = self.calc_file_energy_map(input_file, parameters)
+        silence_map = SilenceMap.from_energy_map(energy_map)
+
+        # silences of the current settings are kept in the index
+        silence_thresh = self.calc_file_silence_thresh(silence_map, store,
+                                                       input_file)
+        silence_map.set_silences(
+            self.find_silences(silence_map.energy, self.silence_len,
+                               silence_thresh, silence_map.resolution),
+            self.silence_len, float(np.median(silence_thresh)))
+
+        if self.silence_index:
+            try:
+                silence_map.save(input_file)
+            except OSError as err:
                 self.progress(store, warning=True,
-                              message=f'Detecting silence is difficult. I increase dBFS.')
-                silence_thresh -= 0.1 * silence_thresh
-                time_calc_silence = chunk_len
-                iteration = 0
+                              message=f'The silence index is not saved({err}).')
+
+        return silence_map
+
+    def calc_file_silence_thresh(self, silence_map, store=None,
+                                 input_file=None) -> float:
+        """
+        Calc the silence threshold by loudness of the whole file.
+        With 'auto' thresholds follow the local noise floor
+        (see calc_local_silence_thresh).
+        """
+
+        if self.level_dBFS == 'auto':
+            return self.calc_local_silence_thresh(
+                silence_map.energy, silence_map.resolution, store,
+                f'{input_file}:plan')
+
+        if self.level_dBFS != 'calc':
+            return self.level_dBFS
+
+        file_dBFS = silence_map.dBFS()
+        if not np.isfinite(file_dBFS):
+            return file_dBFS
+
+        return self.calc_silence_thresh(file_dBFS)
+
+    def plan_parts(self, input_file, store, parameters=None,
+                   n=None, silence_map=None) -> List:
+        """
+        Plan time intervals of parts by the silence map:
+        - Get the silence map (the index or one decoding pass)
+        - For 'split_by_silence' find split points in the ends
+          of n chunks like pipelines do
+        - For 'split_by_duration' find all silences and choose
+          split points for the target part length
+        - For 'split_by_vad' find pauses of speech in the ends
+          of n chunks (only search regions are decoded)
+
+        """
+        if parameters is None:
+            parameters = self.get_parameters(input_file)
+        duration = self.calc_duration(parameters)
+        if n is None:
+            n = self.n_split
+
+        print(m := f'\rProcessing {os.path.basename(input_file)} (plan parts)',
+              end=' ' * 20)
+        self.progress(store, message=m[1:])
+
+        with self.measure(store, 'plan', 0, input_file):
+            if self.how == 'split_by_vad':
+                return self.plan_parts_by_vad(input_file, parameters, n,
+                                              duration, store)
+
+            if silence_map is None:
+                silence_map = self.get_silence_map(input_file, parameters, store)
+
+            if self.how == 'split_by_silence':
+                return self.plan_parts_by_silence(silence_map, n,
+                                                  duration, store, input_file)
+
+            target = self.part_duration or duration / self.n_split
+            tolerance = self.tolerance
+            if tolerance is None:
+                tolerance = target / 5
+
+            silence_thresh = self.calc_file_silence_thresh(silence_map, store,
+                                                           input_file)
+            if not np.all(np.isfinite(silence_thresh)):
+                return self.calc_list_of_parts(
+                    max(1, round(duration / target)), duration)
+
+            silences = self.find_silences(silence_map.energy, self.silence_len,
+                                          silence_thresh, silence_map.resolution)
+            split_points = self.plan_split_points(
+                silence_map.energy, silences, target * 1000, tolerance * 1000,
+                self.silence_len, silence_map.resolution)
+
+        points = [0] + [point / 1000 for point in split_points] + [duration]
+
+        return list(zip(points[:-1], points[1:]))
+
+    def plan_parts_by_silence(self, silence_map, n, duration,
+                              store=None, input_file=None) -> List:
+        """
+        Plan parts for 'split_by_silence' the same way pipelines
+        split chunks: the chunk is from the previous split point
+        to the end of the equal interval, the split point is
+        the last silence in the end of the chunk.
+        Envelopes of search regions come from the silence map.
+        """
+
+        points = [0]
+        for i, (_, end) in enumerate(self.calc_list_of_parts(n, duration)[:-1],
+                                     start=1):
+            self.check_cancel()
+            start = points[-1] * 1000
+            chunk_len = round(end * 1000 - start)
+
+            if self.level_dBFS == 'auto':
+                silence_thresh = 'auto'
+            elif self.level_dBFS == 'calc':
+                chunk_dBFS = silence_map.dBFS(start, start + chunk_len)
+                silence_thresh = chunk_dBFS
+                if np.isfinite(chunk_dBFS):
+                    silence_thresh = self.calc_silence_thresh(chunk_dBFS)
+            else:
+                silence_thresh = self.level_dBFS
+
+            regions = self.calc_search_regions(chunk_len)
+            envelope = silence_map.envelope(start + regions[-1],
+                                            start + chunk_len)
+            end_time_chunk = self.find_split_point(
+                envelope, regions, self.silence_len, silence_thresh, store,
+                f'{input_file}:{i}')
+            points.append((start + end_time_chunk) / 1000)
+
+        points.append(duration)
+
+        return list(zip(points[:-1], points[1:]))
+
+    def plan_parts_by_vad(self, input_file, parameters, n, duration,
+                          store=None) -> List:
+        """
+        Plan parts for 'split_by_vad' the same way pipelines
+        split chunks. Search regions are decoded to the analysis
+        format, the rest of the file is not decoded.
+        """
+
+        frame_rate, channels = self.get_analysis_format(parameters)
+        points = [0]
+        for i, (_, end) in enumerate(self.calc_list_of_parts(n, duration)[:-1],
+                                     start=1):
+            self.check_cancel()
+            start = points[-1] * 1000
+            chunk_len = round(end * 1000 - start)
+
+            regions = self.calc_search_regions(chunk_len)
+            data = b''.join(self.decode_stream(
+                input_file, frame_rate, channels,
+                start_second=(start + regions[-1]) / 1000,
+                duration=(chunk_len - regions[-1]) / 1000))
+            window = pydub.AudioSegment(data=data, sample_width=2,
+                                        frame_rate=frame_rate,
+                                        channels=channels)
+            end_time_chunk = self.find_pause(window, regions, self.silence_len,
+                                             store, f'{input_file}:{i}')
+            points.append((start + end_time_chunk) / 1000)
+
+        points.append(duration)
+
+        return list(zip(points[:-1], points[1:]))
+
+    def preview_parts(self, input_file=None, parameters=None,
+                      decode=True) -> List:
+        """
+        Plan time intervals of parts without splitting (the preview).
+        With the saved silence index it takes milliseconds, without it
+        the file is decoded or None is returned if 'decode' is False.
+        """
+
+        if input_file is None:
+            input_file = self.full_filename
+        if parameters is None:
+            parameters = self.get_parameters(input_file)
+
+        n = self.n_split
+        if self.part_duration:
+            n = self.calc_n_split(parameters)
+
+        if self.how == 'raw_split':
+            return self.calc_list_of_parts(n, self.calc_duration(parameters))
+
+        silence_map = SilenceMap.load(input_file) if self.silence_index else None
+        if (silence_map is None or self.how == 'split_by_vad') and not decode:
+            return None
+
+        return self.plan_parts(input_file, self.store, parameters,
+                               n, silence_map)
+
+    def calc_overview(self, input_file=None, parameters=None) -> PeakPyramid:
+        """
+        Return the peak pyramid of the file for the waveform view.
+        One decoding pass makes peaks and the silence index
+        (if there is no index), so split points can be previewed too.
+        With 'silence_index' both are saved next to the source file.
+        """
+
+        if input_file is None:
+            input_file = self.full_filename
+        if parameters is None:
+            parameters = self.get_parameters(input_file)
+
+        if self.silence_index:
+            peak_pyramid = PeakPyramid.load(input_file)
+            if peak_pyramid is not None:
+                return peak_pyramid
+
+        frame_rate, channels = self.get_analysis_format(parameters)
+        with_energy = self.silence_index and SilenceMap.load(input_file) is None
+        energy_map = []
+
+        def blocks():
+            for data in self.decode_stream(input_file, frame_rate, channels):
+                if with_energy:
+                    energy_map.append(self.calc_block_energy(data, frame_rate,
+                                                             channels))
+                yield data
+
+        with self.measure(self.store, 'overview', 0, input_file):
+            peak_pyramid = PeakPyramid.from_blocks(blocks(), frame_rate, channels)
+
+        if with_energy and energy_map:
+            self.get_silence_map(input_file, parameters, self.store,
+                                 energy_map=np.concatenate(energy_map))
+
+        if self.silence_index:
+            try:
+                peak_pyramid.save(input_file)
+            except OSError as err:
+                self.progress(self.store, warning=True,
+                              message=f'The peaks are not saved({err}).')
+
+        return peak_pyramid
+
+    def get_analysis_factor(self, frame_rate) -> int:
+        """
+        Decimation factor of the analysis stream: the largest divisor
+        of the frame rate which keeps it not lower than 'analysis_rate',
+        so every analysis frame is exactly 'factor' frames of the source
+        """
+
+        if not self.analysis_rate or frame_rate <= self.analysis_rate:
+            return 1
+
+        return max(factor for factor in range(1, frame_rate // self.analysis_rate + 1)
+                   if frame_rate % factor == 0)
+
+    def get_analysis_format(self, parameters) -> Tuple[int, int]:
+        """
+        Frame rate and number of channels to decode the file for
+        analysis. The PCM cache is read in the source format,
+        channels are kept (ffmpeg averages them), blocks are
+        downmixed by analysis_chunk.
+        """
+
+        frame_rate, channels = self.get_audio_format(parameters)
+        if not self.analysis_rate or self.pcm_cache is not None:
+            return frame_rate, channels
+
+        return frame_rate // self.get_analysis_factor(frame_rate), channels
+
+    def analysis_chunk(self, chunk) -> pydub.AudioSegment:
+        """
+        Return the mono chunk with the analysis frame rate: every
+        'factor'-th frame is taken (the mean square is kept without
+        filtering, the data is not copied before it) and channels are
+        downmixed by RMS with the sign of the first channel, so loudness
+        of uncorrelated and antiphase channels is kept. Times (ms)
+        of both chunks are the same, so split points are exact sample
+        positions of the source.
+        """
+
+        factor = self.get_analysis_factor(chunk.frame_rate)
+        if not self.analysis_rate or (factor == 1 and chunk.channels == 1):
+            return chunk
+
+        dtype = f'<i{chunk.sample_width}'
+        samples = np.frombuffer(chunk.raw_data, dtype=dtype)
+        frames = len(samples) // chunk.channels
+        picked = samples[:frames * chunk.channels].reshape(
+            frames, chunk.channels)[::factor]
+        if chunk.channels == 1:
+            mono = picked[:, 0]
+        else:
+            # columns are added, reducing the short axis is much slower
+            squares = sum(np.square(picked[:, channel], dtype=np.float64)
+                          for channel in range(chunk.channels)) / chunk.channels
+            mono = np.clip(np.round(np.copysign(np.sqrt(squares), picked[:, 0])),
+                           -chunk.max_possible_amplitude,
+                           chunk.max_possible_amplitude - 1)
+
+        return pydub.AudioSegment(data=mono.astype(dtype).tobytes(),
+                                  sample_width=chunk.sample_width,
+                                  frame_rate=chunk.frame_rate // factor,
+                                  channels=1)
+
+    def calc_loudness_envelope(self, chunk) -> Dict:
+        """
+        Calc the energy envelope of the chunk with 1 ms resolution.
+        The envelope keeps cumulative sums of squared samples and
+        cumulative numbers of samples, so the RMS of any window
+        is calculated from two values of the arrays.
+
+        """
+        sample_width = chunk.sample_width
+        channels = chunk.channels
+        frame_count = int(chunk.frame_count())
+        chunk_len = len(chunk)
+
+        samples = np.frombuffer(chunk.raw_data,
+                                dtype=f'<i{sample_width}')
+
+        # frame boundaries of every millisecond (the same as pydub slices)
+        bounds = (np.arange(chunk_len + 1) *
+                  (chunk.frame_rate / 1000.0)).astype(np.int64)
+        sample_bounds = np.minimum(bounds, frame_count) * channels
+
+        # int64 is exact for 8/16 bit samples, 32 bit needs float64
+        dtype = np.int64 if sample_width <= 2 else np.float64
+        energy = np.zeros(chunk_len + 1, dtype=dtype)
+
+        # squares of samples are calculated by blocks to save memory
+        block_ms = 60_000
+        for start in range(0, chunk_len, block_ms):
+            end = min(start + block_ms, chunk_len)
+            first = sample_bounds[start]
+            block = samples[first:sample_bounds[end]].astype(dtype)
+            squares = np.zeros(len(block) + 1, dtype=dtype)
+            np.cumsum(block * block, out=squares[1:])
+            energy[start + 1:end + 1] = (
+                squares[sample_bounds[start + 1:end + 1] - first] -
+                squares[sample_bounds[start:end] - first])
+
+        np.cumsum(energy, out=energy)
+
+        return {'energy': energy,
+                'samples': bounds * channels,
+                'max_amplitude': chunk.max_possible_amplitude}
+
+    def calc_windows_rms(self, envelope, window_len,
+                         start=0) -> np.ndarray:
+        """
+        Calc RMS of all windows with the length 'window_len' ms
+        which start from 'start' ms with the step 1 ms.
+        RMS is rounded down like audioop.rms does.
+
+        """
+        energy = envelope['energy']
+        samples = envelope['samples']
+        last_start = len(energy) - 1 - window_len
+        if last_start < start:
+            return np.zeros(0)
+
+        window_energy = (energy[start + window_len:] -
+                         energy[start:last_start + 1])
+        window_samples = (samples[start + window_len:] -
+                          samples[start:last_start + 1])
+
+        rms = np.zeros(len(window_energy))
+        np.divide(window_energy, window_samples, out=rms,
+                  where=window_samples > 0)
+
+        return np.floor(np.sqrt(rms))
+
+    def find_silent_ranges(self, silent_starts,
+                           min_silence_len) -> List[List[int]]:
+        """
+        Join starts of silent windows to the silent ranges
+        the same way pydub.silence.detect_silence does:
+        windows with a gap not longer than 'min_silence_len'
+        belong to one range.
+
+        """
+        if not len(silent_starts):
+            return []
+
+        gaps = np.flatnonzero(np.diff(silent_starts) > min_silence_len)
+        range_starts = silent_starts[np.concatenate(([0], gaps + 1))]
+        range_ends = silent_starts[np.concatenate((gaps, [-1]))]
+        range_ends = range_ends + min_silence_len
+
+        return [[int(start), int(end)]
+                for start, end in zip(range_starts, range_ends)]
 
+    def calc_search_regions(self, chunk_len) -> List[int]:
+        """
+        Calc starts of the regions in the end of the chunk where
+        silence is searched, from the shortest to the widest
+        (the last ~5%, ~11%, ~18% of the chunk)
+
+        """
+        regions = []
+        time_calc_silence = chunk_len
+        for iteration in range(3):
             time_calc_silence -= chunk_len // (20 - iteration * 3)
-            silence = pydub.silence.detect_silence(
-                chunk[time_calc_silence:],
-                min_silence_len=min_silence_len,
-                silence_thresh=silence_thresh)
-            iteration += 1
+            regions.append(time_calc_silence)
+
+        return regions
+
+    def calc_silence_thresh(self, chunk_dBFS) -> int:
+        """
+        Calc the silence threshold by loudness of the chunk
+        """
+
+        silence_thresh = int(chunk_dBFS)
+        silence_thresh += silence_thresh // 2
+
+        return silence_thresh
+
+    def calc_level_histogram(self, energy, resolution=1,
+                             frame_len=50) -> np.ndarray:
+        """
+        Histogram of loudness of 'frame_len' ms frames by the energy map
+        (mean squares relative to the max amplitude): 0.5 dB bins
+        from -120 to 0 dBFS, digital silence is in the first bin
+        """
+
+        frame = max(1, round(frame_len / resolution))
+        n = len(energy) // frame
+        if not n:
+            frames = np.asarray(energy, dtype=np.float64)[:1]
+        else:
+            frames = energy[:n * frame].reshape(n, frame).mean(axis=1,
+                                                                 dtype=np.float64)
+
+        with np.errstate(divide='ignore'):
+            levels = 10 * np.log10(frames)
+        bins = np.floor((np.maximum(levels, -120) + 120) * 2)
+
+        return np.bincount(np.clip(bins, 0, 239).astype(np.int64), minlength=240)
 
-        end_time_chunk = time_calc_silence + sum(silence[-1]) / 2
+    def estimate_noise_floor(self, histogram) -> Dict:
+        """
+        Estimate the silence threshold which splits quiet and
+        loud frames by Otsu's method and the noise floor (the 10th
+        percentile of loudness of quiet frames), so rare pauses are
+        found too. If loudness is not bimodal (classes are closer
+        than 10 dB) the noise floor is the 10th percentile of all
+        frames and the threshold is 6 dB above it.
+        Digital silence is not counted.
+        """
+
+        levels = np.arange(len(histogram)) / 2 - 120 + 0.25
+        histogram = np.asarray(histogram, dtype=np.float64).copy()
+        frames = int(histogram.sum())
+        if histogram[1:].any():
+            histogram[0] = 0
+        total = histogram.sum()
+        if not total:
+            return {'noise_floor': -float('inf'), 'speech_level': -float('inf'),
+                    'silence_thresh': -float('inf'), 'method': 'silence',
+                    'frames': frames}
+
+        cumulative = np.cumsum(histogram)
+        noise_floor = float(levels[np.searchsorted(cumulative, 0.1 * total)])
+        speech_level = float(levels[np.searchsorted(cumulative, 0.5 * total)])
+
+        # the variance between classes of every threshold
+        weights = cumulative / total
+        means = np.cumsum(histogram * levels) / total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            between = ((means[-1] * weights - means) ** 2 /
+                       (weights * (1 - weights)))
+        between = np.nan_to_num(between, nan=-1, posinf=-1)
+        # empty bins between classes give the same variance,
+        # the threshold is in the middle of the gap
+        best = np.flatnonzero(np.isclose(between, between.max()))
+        k = int(best[(len(best) - 1) // 2])
+        quiet_mean = means[k] / max(weights[k], 1e-12)
+        loud_mean = (means[-1] - means[k]) / max(1 - weights[k], 1e-12)
+
+        if weights[k] < 1 and loud_mean - quiet_mean >= 10:
+            noise_floor = float(levels[np.searchsorted(cumulative, 0.1 * cumulative[k])])
+            silence_thresh = float(levels[k] + 0.25)
+            method = 'otsu'
+        else:
+            silence_thresh = noise_floor + 6
+            method = 'percentile'
+
+        return {'noise_floor': noise_floor, 'speech_level': speech_level,
+                'silence_thresh': silence_thresh,
+                'method': method, 'frames': frames}
+
+    def calc_local_silence_thresh(self, energy, resolution=1, store=None,
+                                  key=None, segment_len=300) -> np.ndarray:
+        """
+        Thresholds (dBFS) of values of the energy map which follow
+        the noise floor: it is estimated in segments of 'segment_len'
+        seconds and interpolated between their centers.
+        Estimates are saved to the store by 'noise_floor:<key>'.
+        """
+
+        segment = max(1, int(segment_len * 1000 / resolution))
+        starts = np.arange(0, max(len(energy), 1), segment)
+        estimates = [self.estimate_noise_floor(self.calc_level_histogram(
+            energy[start:start + segment], resolution)) for start in starts]
+
+        if store is not None and key is not None:
+            store[f'noise_floor:{key}'] = {
+                'segment_len': segment_len,
+                **{name: [estimate[name] for estimate in estimates]
+                   for name in ('noise_floor', 'speech_level',
+                                'silence_thresh', 'method', 'frames')}}
+
+        thresholds = np.array([estimate['silence_thresh'] for estimate in estimates])
+        if not np.all(np.isfinite(thresholds)):
+            # digital silence segments take thresholds of neighbours
+            finite = np.isfinite(thresholds)
+            if not finite.any():
+                return np.full(len(energy), -float('inf'))
+            thresholds = np.interp(starts, starts[finite], thresholds[finite])
+
+        centers = np.minimum(starts + segment / 2, len(energy))
+
+        return np.interp(np.arange(len(energy)), centers, thresholds)
+
+    def find_split_point(self, envelope, regions, min_silence_len,
+                         silence_thresh, store=None, key=None) -> float:
+        """
+        Find the last silence in the search regions and return
+        middle of this silence time from the start of the chunk.
+        The envelope is calculated from the start of the widest region.
+
+        The RMS of windows is calculated once, the search regions
+        and the increasing thresholds are queries to it, so the best
+        split point is found without rescans.
+        With silence_thresh='auto' the threshold is estimated by the noise
+        floor of the widest region, the estimate is saved to the store
+        by 'noise_floor:<key>'.
+
+        """
+        self.check_cancel()
+
+        if silence_thresh == 'auto':
+            energy = (np.diff(envelope['energy']) /
+                      np.maximum(np.diff(envelope['samples']), 1) /
+                      envelope['max_amplitude'] ** 2)
+            estimate = self.estimate_noise_floor(self.calc_level_histogram(energy))
+            silence_thresh = estimate['silence_thresh']
+            if store is not None and key is not None:
+                store[f'noise_floor:{key}'] = estimate
+
+        rms = self.calc_windows_rms(envelope, min_silence_len)
+        if not len(rms):
+            return regions[-1] + len(envelope['energy']) - 1
+
+        # the quietest window of each region
+        offsets = [start - regions[-1] for start in regions]
+        min_rms = [rms[offset:].min() if offset < len(rms) else np.inf
+                   for offset in offsets]
+
+        # increase the threshold until any region has silence
+        max_amplitude = envelope['max_amplitude']
+        threshold = pydub.utils.db_to_float(silence_thresh) * max_amplitude
+        increases = 0
+        while threshold < min_rms[-1] and increases < 100:
+            silence_thresh -= 0.1 * silence_thresh
+            threshold = pydub.utils.db_to_float(silence_thresh) * max_amplitude
+            increases += 1
+
+        self.count('silence_retries', increases)
+        if increases:
+            self.progress(store, warning=True,
+                          message=(f'Detecting silence is difficult. '
+                                   f'I increase dBFS to {silence_thresh:.1f}.'))
+
+        # there is no silence, so the quietest window is used
+        threshold = max(threshold, min_rms[-1])
+
+        for offset, region_min_rms in zip(offsets, min_rms):
+            if region_min_rms <= threshold:
+                break
+
+        silent_starts = np.flatnonzero(rms[offset:] <= threshold) + offset
+        silence = self.find_silent_ranges(silent_starts, min_silence_len)
+
+        return regions[-1] + sum(silence[-1]) / 2
+
+    def detect_silence(self, chunk, min_silence_len=500,
+                       dBFS='calc', store=None, key=None) -> float:
+        """
+        Detect silence in the end of the chunk and return
+        middle of this silence time. This time uses for splitting.
+        The loudness envelope is calculated once for the search regions
+        of the analysis chunk (mono with the analysis frame rate).
+
+        """
+        chunk = self.analysis_chunk(chunk)
+        if dBFS == 'calc':
+            silence_thresh = self.calc_silence_thresh(chunk.dBFS)
+        else:
+            silence_thresh = dBFS
+
+        regions = self.calc_search_regions(len(chunk))
+        envelope = self.calc_loudness_envelope(chunk[regions[-1]:])
+
+        end_time_chunk = self.find_split_point(
+            envelope, regions, min_silence_len, silence_thresh, store, key)
 
         return end_time_chunk
 
+    def find_pause(self, window, regions, min_pause_len,
+                   store=None, key=None) -> float:
+        """
+        Find the longest pause of speech in the search regions
+        (the shortest region with a pause is used) and return
+        middle of this pause time from the start of the chunk.
+        The window is the analysis chunk from the start of the widest
+        region. If there are no pauses the split point is found
+        by silence.
+
+        """
+        self.check_cancel()
+
+        # samples are not copied, frames are converted by blocks
+        samples = np.frombuffer(window.raw_data, dtype=f'<i{window.sample_width}')
+        if window.channels > 1:
+            samples = samples[:len(samples) // window.channels * window.channels]
+            samples = samples.reshape(-1, window.channels)
+        detector = VoiceActivityDetector(window.frame_rate)
+        pauses = detector.pauses(samples, min_pause_len,
+                                 scale=window.max_possible_amplitude)
+
+        for start in regions:
+            offset = start - regions[-1]
+            region_pauses = [[max(begin, offset), end] for begin, end in pauses
+                             if end - max(begin, offset) >= min_pause_len]
+            if region_pauses:
+                # the later one of the longest pauses
+                begin, end = max(region_pauses,
+                                 key=lambda pause: (pause[1] - pause[0], pause[0]))
+                return regions[-1] + (begin + end) / 2
+
+        self.count('vad_fallbacks')
+        self.progress(store, warning=True,
+                      message=('Detecting pauses of speech is difficult. '
+                               'I split by silence.'))
+
+        silence_thresh = self.level_dBFS
+        if silence_thresh == 'calc':
+            silence_thresh = 'auto'
+
+        return self.find_split_point(self.calc_loudness_envelope(window),
+                                     regions, min_pause_len, silence_thresh,
+                                     store, key)
+
+    def detect_pause(self, chunk, min_pause_len=500,
+                     store=None, key=None) -> float:
+        """
+        Detect the pause of speech in the end of the chunk and return
+        middle of this pause time. This time uses for splitting.
+        Speech is detected in the analysis chunk (see find_pause).
+
+        """
+        chunk = self.analysis_chunk(chunk)
+        regions = self.calc_search_regions(len(chunk))
+
+        return self.find_pause(chunk[regions[-1]:], regions, min_pause_len,
+                               store, key)
+
+    def detect_split_point(self, chunk, min_silence_len=500,
+                           store=None, key=None) -> float:
+        """
+        Detect the split point in the end of the chunk by pauses
+        of speech for 'split_by_vad' or by silence
+        """
+
+        if self.how == 'split_by_vad':
+            return self.detect_pause(chunk, min_silence_len, store, key)
+
+        return self.detect_silence(chunk, min_silence_len,
+                                   self.level_dBFS, store, key)
+
     def save_data(self, chunk, n, file_name,
                   format_='mp3', bitrate='128k',
-                  tags=None, store=None) -> None:
+                  tags=None, store=None, key=None,
+                  pause_len=0) -> None:
         """
-        Save audio file with params
+        Save audio file with params, PCM data is streamed
+        to ffmpeg over stdin without temp files, pauses
+        of 'pause_len' ms are written before and after it.
+        In the multiprocessing mode the chunk is taken from the store
+        by the key (by default it is the number of the part),
+        data of shared memory is written without copying.
         """
 
-        if isinstance(store, multiprocessing.managers.DictProxy):
-            chunk = store[n]
+        if key is None:
+            key = n
 
-        if tags is None:
-            tags = {'artist': f'{file_name}', 'track': f'Part {n}'}
+        if isinstance(store, SharedChunkStore):
+            descriptor = store.store[key]
+            with store.attach(descriptor) as views:
+                self.encode_data(views, n, file_name,
+                                 descriptor['frame_rate'],
+                                 descriptor['sample_width'],
+                                 descriptor['channels'],
+                                 format_, bitrate, tags, pause_len)
 
-        if format_ == 'mp3':
-            chunk.export(f'{file_name}_{n}',
-                         format=format_,
-                         bitrate=bitrate,
-                         tags=tags)
+        else:
+            if isinstance(store, multiprocessing.managers.DictProxy):
+                chunk = store[key]
+            self.encode_data([chunk.raw_data], n, file_name,
+                             chunk.frame_rate, chunk.sample_width,
+                             chunk.channels, format_, bitrate, tags,
+                             pause_len)
+
+        self.count('bytes_encoded', os.path.getsize(f'{file_name}_{n}'))
+        self.checkpoint(file_name, n)
+
+    def encode_data(self, views, n, file_name,
+                    frame_rate, sample_width, channels,
+                    format_='mp3', bitrate='128k', tags=None,
+                    pause_len=0) -> None:
+        """
+        Encode pieces of PCM data (bytes or memoryviews)
+        to the file by one ffmpeg process. Pauses are zero frames
+        written to the encoder, the data is not copied.
+        """
+
+        frame_width = sample_width * channels
+        pause_size = int(pause_len * frame_rate / 1000) * frame_width
+
+        def pause():
+            # one block of silence (1 s at most) is written many times
+            block = b'\x00' * min(pause_size, frame_rate * frame_width)
+            for start in range(0, pause_size, max(len(block), 1)):
+                yield block[:pause_size - start]
+
+        encoder = self.open_encoder(file_name, n, frame_rate, channels,
+                                    format_, bitrate, tags, sample_width)
+        try:
+            for view in itertools.chain(pause(), views, pause()):
+                encoder.stdin.write(view)
+        except BrokenPipeError:
+            # the error of ffmpeg is raised by close_encoder
+            pass
+
+        self.close_encoder(encoder)
+
+    def get_encoders(self, n_encoders) -> concurrent.futures.ThreadPoolExecutor:
+        """
+        Return the long-lived pool of encoder threads. Every thread
+        streams PCM data to its ffmpeg process, so encoding runs
+        in parallel with decoding and analysis by the worker pool.
+        """
+
+        if self.encoders is not None and self.encoders._max_workers != n_encoders:
+            self.encoders.shutdown()
+            self.encoders = None
+
+        if self.encoders is None:
+            self.encoders = concurrent.futures.ThreadPoolExecutor(
+                max_workers=n_encoders, thread_name_prefix='encoder')
 
-        elif format_ == 'wav':
-            chunk.export(f'{file_name}_{n}',
-                         format=format_)
+        return self.encoders
 
     def processing_pipeline(self, input_file, n,
                             add_pause, pause_len,
@@ -194,30 +1689,54 @@ class SmartAudioSplitter:
         - Calc time intervals
         - Load data by chunks
         - Detect silence
-        - Add pause
-        - Save file
+        - Save file with pauses by encoder threads
+          while next parts are loading
+          (with 'max_memory' the next part is loaded when
+          parts in encoders and it fit the budget)
 
         """
 
         # Get duration of audio data
         parameters = self.get_parameters(input_file)
-        if 'duration' in parameters:
-            duration = float(parameters['duration'])
-        elif 'ffprobe_duration' in parameters:
-            duration = float(parameters['ffprobe_duration'])
+        duration = self.calc_duration(parameters)
+
+        # Decode the file to the cache once
+        self.prepare_pcm_cache(input_file, parameters)
 
         # Calc time intervals
-        chunks_times = self.calc_list_of_parts(n, duration)
+        chunks_times = self.calc_parts_times(input_file, n, duration)
 
         # Calc the total number of tasks
-        len_all_tasks = n + n + n * add_pause + n
+        len_all_tasks = n + n + n
 
         # Save progress
         self.progress(store, set_max=True, maximum=len_all_tasks)
 
+        encoders = self.get_encoders(self.n_encoders)
+        saving = {}
+        frame_rate, channels = self.get_audio_format(parameters)
+        exported = self.done_parts(out_filename)
+
         # Load data by chunks
         to_next_chunk = []
         for i, (start, end) in enumerate(chunks_times, start=1):
+            self.check_cancel()
+
+            # parts exported by the previous run of the job
+            if i in exported:
+                self.progress(store, tick=2, message=f'Part {i} is exported')
+                continue
+
+            # back-pressure: wait for encoders if the part
+            # does not fit the memory budget
+            size = int((end - start) * frame_rate) * channels * 2
+            while (self.max_memory and saving and
+                   sum(n_bytes for _, n_bytes in saving.values()) + size > self.max_memory):
+                done, _ = concurrent.futures.wait(
+                    saving, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self.check_task(future, ('save', saving.pop(future)[0]), store)
+
             print(m := (f'\rProcessing part {i} '
                         f'(load audio data)'), end=' ' * 20)
             self.progress(store, tick=1, message=m[1:])
@@ -229,81 +1748,573 @@ class SmartAudioSplitter:
             else:
                 duration = end - start_second
 
-            chunk = pydub.AudioSegment.from_file(
-                input_file,
-                start_second=start_second,
-                duration=duration)
+            with self.measure(store, 'load', i, input_file):
+                chunk = self.load_chunk(input_file,
+                                        start_second=start_second,
+                                        duration=duration)
 
-            if how == 'split_by_silence':
+            if how in ('split_by_silence', 'split_by_vad'):
                 print(m := (f'\rProcessing part {i} '
-                            f'(split by silence)'), end=' ' * 20)
+                            f'({how.replace("_", " ")})'), end=' ' * 20)
                 self.progress(store, tick=1, message=m[1:])
 
-                end_time_chunk = self.detect_silence(
-                    chunk,
-                    min_silence_len=silence_len,
-                    dBFS=self.level_dBFS,
-                    store=store)
+                with self.measure(store, 'split', i, input_file):
+                    end_time_chunk = self.detect_split_point(
+                        chunk,
+                        min_silence_len=silence_len,
+                        store=store,
+                        key=f'{input_file}:{i}')
+
+                    to_next_chunk = chunk[end_time_chunk:]
+                    chunk = chunk[:end_time_chunk]
+
+            print(m := (f'\rProcessing part {i} '
+                        f'(save audio data)'), end=' ' * 20)
+            self.progress(store, tick=1, message=m[1:])
+
+            # the part is encoded while the next part is loading,
+            # only 'n_encoders' parts are kept in memory for encoding
+            if len(saving) >= self.n_encoders:
+                done, _ = concurrent.futures.wait(
+                    saving, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self.check_task(future, ('save', saving.pop(future)[0]), store)
+
+            saving[encoders.submit(
+                self.multiprocessing_task,
+                (store, 'save', i, input_file, time.time()),
+                'save_data', chunk, i,
+                file_name=out_filename,
+                format_=format_,
+                bitrate=bitrate,
+                tags=tags,
+                pause_len=pause_len if add_pause else 0)] = (i, len(chunk.raw_data))
+
+        for future, (i, _) in saving.items():
+            self.check_task(future, ('save', i), store)
+        self.check_cancel()
+
+        self.progress(store, tick=1, message='Done')
+
+    def get_audio_format(self, parameters) -> Tuple[int, int]:
+        """
+        Get frame rate and number of channels from parameters
+        of the audio file. If ffprobe returned only duration,
+        the CD format is used.
+        """
+
+        frame_rate = int(parameters.get('sample_rate', 44100))
+        channels = int(parameters.get('channels', 2))
+
+        return frame_rate, channels
+
+    def decode_stream(self, input_file, frame_rate, channels,
+                      block_len=10000, start_second=0, duration=None):
+        """
+        Decode the audio file (or its segment from 'start_second')
+        by one ffmpeg process (or read the PCM cache) and yield
+        raw PCM data (16 bit) by blocks of 'block_len' ms
+        """
+
+        block_size = block_len * frame_rate // 1000 * channels * 2
+
+        # the cached PCM data is read without decoding
+        if self.pcm_cache is not None:
+            meta = self.pcm_cache.get(input_file, frame_rate, channels)
+            frame_width = channels * 2
+            position = int(start_second * frame_rate) * frame_width
+            end = float('inf')
+            if duration is not None:
+                end = int((start_second + duration) * frame_rate) * frame_width
+            with open(meta['pcm_path'], 'rb') as f:
+                f.seek(position)
+                while position < end and (data := f.read(
+                        int(min(block_size, end - position)))):
+                    self.check_cancel()
+                    position += len(data)
+                    self.count('bytes_decoded', len(data))
+                    yield data
+            return
+
+        args = ['ffmpeg', '-v', 'error']
+        if start_second:
+            args += ['-ss', str(start_second)]
+        args += ['-i', input_file]
+        if duration is not None:
+            args += ['-t', str(duration)]
+        args += ['-f', 's16le', '-acodec', 'pcm_s16le',
+                 '-ar', str(frame_rate), '-ac', str(channels),
+                 '-']
+        popen = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        try:
+            while data := popen.stdout.read(block_size):
+                self.check_cancel()
+                self.count('bytes_decoded', len(data))
+                yield data
+
+            error = popen.stderr.read()
+            if popen.wait():
+                raise RuntimeError(f'ffmpeg decoding error: {error.decode()}')
+
+        finally:
+            if popen.poll() is None:
+                popen.kill()
+                popen.wait()
+            popen.stdout.close()
+            popen.stderr.close()
+
+    def encoder_args(self, format_, bitrate='128k',
+                     sample_width=2) -> Tuple[str, List[str]]:
+        """
+        Return the ffmpeg muxer and codec options of the output format
+        """
+
+        codecs = {'mp3': ('mp3', ['-c:a', 'libmp3lame', '-b:a', bitrate]),
+                  'opus': ('opus', ['-c:a', 'libopus', '-b:a', bitrate]),
+                  'ogg': ('ogg', ['-c:a', 'libvorbis', '-b:a', bitrate]),
+                  'aac': ('adts', ['-c:a', 'aac', '-b:a', bitrate]),
+                  'm4a': ('ipod', ['-c:a', 'aac', '-b:a', bitrate]),
+                  'm4b': ('ipod', ['-c:a', 'aac', '-b:a', bitrate]),
+                  'flac': ('flac', ['-c:a', 'flac']),
+                  'wav': ('wav', ['-c:a', self.pcm_format(sample_width)[1]])}
+
+        # other formats use the default codec of the muxer
+        return codecs.get(format_, (format_, ['-b:a', bitrate]))
+
+    def pcm_format(self, sample_width) -> Tuple[str, str]:
+        """
+        Return the ffmpeg raw format and the PCM codec of the sample width
+        """
+
+        # pydub keeps 8 bit samples signed, 8 bit WAV is unsigned
+        # (ffmpeg converts them)
+        if sample_width == 1:
+            return 's8', 'pcm_u8'
+
+        return f's{sample_width * 8}le', f'pcm_s{sample_width * 8}le'
+
+    def open_encoder(self, file_name, n, frame_rate, channels,
+                     format_='mp3', bitrate='128k',
+                     tags=None, sample_width=2) -> subprocess.Popen:
+        """
+        Start ffmpeg which encodes raw PCM data
+        from stdin to the file with params
+        """
+
+        if tags is None:
+            tags = {'artist': f'{file_name}', 'track': f'Part {n}'}
+
+        muxer, codec_args = self.encoder_args(format_, bitrate, sample_width)
+
+        args = ['ffmpeg', '-y', '-v', 'error',
+                '-f', self.pcm_format(sample_width)[0],
+                '-ar', str(frame_rate), '-ac', str(channels),
+                '-i', '-']
+        args += codec_args
+        if format_ != 'wav':
+            for key, value in tags.items():
+                args += ['-metadata', f'{key}={value}']
+        args += ['-f', muxer, f'{file_name}_{n}']
+
+        return subprocess.Popen(args, stdin=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
+    def close_encoder(self, popen) -> None:
+        """
+        Finish encoding and check the result of ffmpeg
+        """
+
+        try:
+            popen.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = popen.stderr.read()
+        popen.stderr.close()
+        if popen.wait():
+            raise RuntimeError(f'ffmpeg encoding error: {error.decode()}')
+
+    def streaming_pipeline(self, input_file, n,
+                           add_pause, pause_len,
+                           silence_len, how,
+                           out_filename, format_,
+                           bitrate, tags, store,
+                           block_len=10000) -> None:
+        """
+        Processing data with one decoder:
+        - Get duration and format
+        - Calc time intervals
+        - Decode audio data by blocks
+        - Write blocks to the encoder of the current part;
+          the search regions of silence are kept in a temp file
+        - Detect silence when the end of the part is read,
+          finish the part and send the rest to the next part
+
+        Memory is a few blocks and the analysis copy of the search
+        region with its envelope (~3 MB per minute of the region,
+        the region is ~18% of the part), the search region is read
+        from the temp file by blocks. The resumed job is decoded from the first part
+        which is not exported.
 
-                to_next_chunk = chunk[end_time_chunk:]
-                chunk = chunk[:end_time_chunk]
+        """
+
+        # Get duration and format of audio data
+        parameters = self.get_parameters(input_file)
+        duration = self.calc_duration(parameters)
+        frame_rate, channels = self.get_audio_format(parameters)
+        frame_width = 2 * channels
+        block_size = block_len * frame_rate // 1000 * frame_width
+
+        # Calc time intervals (ends of parts in frames)
+        chunks_times = self.calc_parts_times(input_file, n, duration)
+        ends = [int(end * frame_rate) for _, end in chunks_times[:-1]]
+        ends.append(float('inf'))
+
+        pause = b''
+        if add_pause:
+            pause = bytes(int(pause_len * frame_rate / 1000) * frame_width)
+
+        # Calc the total number of tasks
+        len_all_tasks = int(duration * 1000 // block_len) + 1 + n
+
+        # Save progress
+        self.progress(store, set_max=True, maximum=len_all_tasks)
+
+        # parts exported by the previous run of the job
+        exported = self.done_parts(out_filename)
+        i = 1
+        while i in exported:
+            i += 1
+        if i > len(chunks_times):
+            self.progress(store, tick=1, message='Done')
+            return
+        start_second = chunks_times[i - 1][0] if i > 1 else 0
+
+        def energy(data):
+            block = self.analysis_chunk(pydub.AudioSegment(
+                data=data[:len(data) // frame_width * frame_width],
+                sample_width=2, frame_rate=frame_rate, channels=channels))
+            samples = np.frombuffer(block.raw_data, dtype='<i2').astype(np.int64)
+            return int(np.dot(samples, samples)), len(samples)
+
+        factor = self.get_analysis_factor(frame_rate)
+        analysis_block = block_size // (frame_width * factor) * frame_width * factor
+
+        def analysis_window(spill, spill_len):
+            if not self.analysis_rate or (factor == 1 and channels == 1):
+                pcm = np.memmap(spill, dtype=np.uint8, mode='r',
+                                shape=(spill_len,))
+                return pydub.AudioSegment(data=pcm, sample_width=2,
+                                          frame_rate=frame_rate, channels=channels)
+
+            # the search region is read and downmixed by blocks,
+            # so only its analysis copy is kept in memory
+            spill.seek(0)
+            data = b''.join(
+                self.analysis_chunk(pydub.AudioSegment(
+                    data=spill.read(analysis_block), sample_width=2,
+                    frame_rate=frame_rate, channels=channels)).raw_data
+                for _ in range(0, spill_len, analysis_block))
+
+            return pydub.AudioSegment(data=data, sample_width=2,
+                                      frame_rate=frame_rate // factor, channels=1)
+
+        def read_spill(spill, start, end, close=False):
+            spill.seek(start)
+            while start < end:
+                data = spill.read(min(block_size, end - start))
+                start += len(data)
+                yield data
+            if close:
+                spill.close()
+
+        # the stack of data sources, the rest of parts is read first
+        sources = [self.decode_stream(input_file, frame_rate,
+                                      channels, block_len,
+                                      start_second=start_second)]
+        position = part_start = int(start_second * frame_rate)
+        part_energy = [0, 0]
+        encoder = self.open_encoder(out_filename, i, frame_rate, channels,
+                                    format_, bitrate, tags)
+        encoder.stdin.write(pause)
+        spill = tempfile.TemporaryFile(dir=self.spill_dir)
+
+        def part_regions():
+            if (ends[i - 1] == float('inf') or
+                    how not in ('split_by_silence', 'split_by_vad')):
+                return None, ends[i - 1]
+            chunk_len = round((ends[i - 1] - part_start) * 1000 / frame_rate)
+            regions = self.calc_search_regions(chunk_len)
+            return regions, part_start + int(regions[-1] * frame_rate / 1000)
+
+        regions, region_start = part_regions()
+
+        while sources:
+            data = next(sources[-1], None)
+            if data is None:
+                sources.pop()
+                continue
+
+            if len(sources) == 1:
+                print(m := (f'\rProcessing part {i} '
+                            f'(stream audio data)'), end=' ' * 20)
+                self.progress(store, tick=1, message=m[1:])
+
+            while data:
+                frames = len(data) // frame_width
+
+                # data before the search region goes to the encoder
+                if position < region_start:
+                    k = int(min(frames, region_start - position)) * frame_width
+                    encoder.stdin.write(data[:k])
+                    part_energy = [a + b for a, b in
+                                   zip(part_energy, energy(data[:k]))]
+
+                # the search region is kept in the temp file
+                elif position < ends[i - 1]:
+                    k = int(min(frames, ends[i - 1] - position)) * frame_width
+                    spill.write(data[:k])
+
+                else:
+                    k = 0
+
+                data = data[k:]
+                position += k // frame_width
+                if position < ends[i - 1]:
+                    continue
+
+                # the end of the part is read, so find the split point
+                spill.flush()
+                spill_len = spill.tell()
+                cut = spill_len
+                if regions is not None and spill_len:
+                    window = analysis_window(spill, spill_len)
+                    envelope = self.calc_loudness_envelope(window)
+
+                    if self.level_dBFS == 'auto':
+                        silence_thresh = 'auto'
+                    elif self.level_dBFS == 'calc':
+                        window_energy = (part_energy[0] +
+                                         int(envelope['energy'][-1]),
+                                         part_energy[1] + len(window.raw_data) // 2)
+                        rms = int(np.sqrt(window_energy[0] /
+                                          max(window_energy[1], 1)))
+                        silence_thresh = self.calc_silence_thresh(
+                            pydub.utils.ratio_to_db(
+                                rms / window.max_possible_amplitude))
+                    else:
+                        silence_thresh = self.level_dBFS
+
+                    print(m := (f'\rProcessing part {i} '
+                                f'({how.replace("_", " ")})'), end=' ' * 20)
+                    self.progress(store, message=m[1:])
+
+                    with self.measure(store, 'split', i, input_file):
+                        if how == 'split_by_vad':
+                            end_time_chunk = self.find_pause(
+                                window, regions, silence_len,
+                                store, f'{input_file}:{i}')
+                        else:
+                            end_time_chunk = self.find_split_point(
+                                envelope, regions, silence_len,
+                                silence_thresh, store, f'{input_file}:{i}')
+                    cut = ((int(end_time_chunk * frame_rate / 1000) -
+                            (region_start - part_start)) * frame_width)
+                    cut = min(max(cut, 0), spill_len)
+                    del window
+
+                # finish the part
+                for piece in read_spill(spill, 0, cut):
+                    encoder.stdin.write(piece)
+                encoder.stdin.write(pause)
+                self.close_encoder(encoder)
+                self.count('bytes_encoded',
+                           os.path.getsize(f'{out_filename}_{i}'))
+                self.checkpoint(out_filename, i)
 
-            if add_pause:
                 print(m := (f'\rProcessing part {i} '
-                            f'(add pause)'), end=' ' * 20)
+                            f'(save audio data)'), end=' ' * 20)
                 self.progress(store, tick=1, message=m[1:])
 
-                silents = pydub.AudioSegment.silent(duration=pause_len)
-                chunk = silents.append(chunk)
-                chunk = chunk.append(silents)
+                # the rest of the part is the beginning of the next part
+                sources.append(iter([data]))
+                sources.append(read_spill(spill, cut, spill_len, close=True))
+                data = b''
+
+                i += 1
+                part_start = position - (spill_len - cut) // frame_width
+                position = part_start
+                part_energy = [0, 0]
+                encoder = self.open_encoder(out_filename, i, frame_rate,
+                                            channels, format_, bitrate, tags)
+                encoder.stdin.write(pause)
+                spill = tempfile.TemporaryFile(dir=self.spill_dir)
+                regions, region_start = part_regions()
+
+        # the file is shorter than its duration, the rest goes to the last part
+        spill_len = spill.tell()
+        for piece in read_spill(spill, 0, spill_len, close=True):
+            encoder.stdin.write(piece)
+        encoder.stdin.write(pause)
+        self.close_encoder(encoder)
+        self.count('bytes_encoded', os.path.getsize(f'{out_filename}_{i}'))
+        self.checkpoint(out_filename, i)
+
+        print(m := (f'\rProcessing part {i} '
+                    f'(save audio data)'), end=' ' * 20)
+        self.progress(store, tick=1, message=m[1:])
+
+        self.progress(store, tick=1, message='Done')
+
+    def cut_stream_copy(self, input_file, start, end,
+                        file_name, n, format_, tags=None) -> None:
+        """
+        Cut the part by ffmpeg without re-encoding (stream copy)
+        """
+
+        if tags is None:
+            tags = {'artist': f'{file_name}', 'track': f'Part {n}'}
+
+        muxers = {'m4a': 'ipod', 'm4b': 'ipod', 'aac': 'adts'}
+
+        args = ['ffmpeg', '-y', '-v', 'error',
+                '-ss', str(start), '-i', input_file,
+                '-t', str(end - start),
+                '-map', '0:a', '-c', 'copy', '-map_metadata', '-1']
+        for key, value in tags.items():
+            args += ['-metadata', f'{key}={value}']
+        args += ['-f', muxers.get(format_, format_), f'{file_name}_{n}']
+
+        popen = subprocess.Popen(args, stderr=subprocess.PIPE)
+        _, error = popen.communicate()
+        if popen.returncode:
+            raise RuntimeError(f'ffmpeg cutting error: {error.decode()}')
+
+    def lossless_pipeline(self, input_file, n,
+                          out_filename, format_,
+                          tags, store) -> None:
+        """
+        Cut parts without decoding and re-encoding:
+        - MP3 is cut by byte slicing on frame boundaries
+        - other formats are cut by ffmpeg stream copy
+        Split points are snapped to the nearest frame boundary.
+
+        """
+
+        if format_ == 'mp3':
+            index = Mp3Index(input_file)
+            duration = index.duration
+        else:
+            parameters = self.get_parameters(input_file)
+            duration = self.calc_duration(parameters)
+
+        # Calc time intervals
+        chunks_times = self.calc_parts_times(input_file, n, duration)
+
+        # Save progress
+        self.progress(store, set_max=True, maximum=n)
+
+        exported = self.done_parts(out_filename)
+        for i, (start, end) in enumerate(chunks_times, start=1):
+            self.check_cancel()
+            if i in exported:
+                self.progress(store, tick=1, message=f'Part {i} is exported')
+                continue
 
             print(m := (f'\rProcessing part {i} '
-                        f'(save audio data)'), end=' ' * 20)
+                        f'(lossless cut)'), end=' ' * 20)
             self.progress(store, tick=1, message=m[1:])
 
-            self.save_data(chunk, i,
-                           file_name=out_filename,
-                           format_=format_,
-                           bitrate=bitrate,
-                           tags=tags)
+            with self.measure(store, 'cut', i, input_file):
+                if format_ == 'mp3':
+                    index.cut(start, end, f'{out_filename}_{i}',
+                              tags=tags or {'artist': f'{out_filename}',
+                                            'track': f'Part {i}'})
+                else:
+                    self.cut_stream_copy(input_file, start, end,
+                                         out_filename, i, format_, tags)
+                self.count('bytes_encoded',
+                           os.path.getsize(f'{out_filename}_{i}'))
+            self.checkpoint(out_filename, i)
 
-        self.progress(store, tick=1, message='Done')
+        self.progress(store, message='Done')
+
+    def multiprocessing_task(self, measured, method, *args, **kwargs):
+        """
+        The Task for the multiprocessing pool
+        Run the method and save metrics of the task to the store,
+        'measured' is (store, phase, part, input_file, submit time)
+        """
+
+        self.check_cancel()
+        with self.measure(*measured):
+            return getattr(self, method)(*args, **kwargs)
+
+    def multiprocessing_task_run_file(self, input_file, out_filename) -> int:
+        """
+        The Task for the multiprocessing pool
+        Split the whole file in the worker without the nested pool
+        (files which can not be cut losslessly are split part by part),
+        return the number of errors of the file
+
+        """
+
+        self.multiprocessing_on = False
+        self.errors = 0
+        self.run_file(input_file, out_filename, dict())
+
+        return self.errors
 
     def multiprocessing_task_load_save(self, input_file,
                                        start, end,
-                                       i, store) -> None:
+                                       i, store, spill=False) -> None:
         """
         The Task for the multiprocessing pool
-        Loads and save data.
+        Loads and save data. With 'spill' the data is saved
+        to a file on disk instead of shared memory.
 
         """
 
         start_second = start
         duration = end - start_second
-        chunk = pydub.AudioSegment.from_file(
-            input_file,
-            start_second=start_second,
-            duration=duration)
+        chunk = self.load_chunk(input_file,
+                                start_second=start_second,
+                                duration=duration)
 
-        store[i] = chunk
+        if spill and isinstance(store, SharedChunkStore):
+            store.set(i, chunk, spill=True)
+        else:
+            store[i] = chunk
 
     def multiprocessing_task_split_by_silence(self, input_file1,
                                               input_file2,
                                               min_silence_len,
-                                              store) -> None:
+                                              store, noise_key=None) -> None:
         """
         The Task for the multiprocessing pool
-        Split by silence two parts
+        Split two parts by silence (or by pauses of speech)
 
         """
+        if isinstance(store, SharedChunkStore):
+            # read the chunk without copying and move only descriptors
+            with store.open(input_file1) as chunk1:
+                end_time_chunk = self.detect_split_point(
+                    chunk1,
+                    min_silence_len=min_silence_len,
+                    store=store,
+                    key=noise_key)
+
+            store.move_tail(input_file1, input_file2, end_time_chunk)
+            return
+
         chunk1 = store[input_file1]
         chunk2 = store[input_file2]
 
-        end_time_chunk = self.detect_silence(
+        end_time_chunk = self.detect_split_point(
             chunk1,
             min_silence_len=min_silence_len,
-            dBFS=self.level_dBFS,
-            store=store)
+            store=store,
+            key=noise_key)
 
         to_next_chunk = chunk1[end_time_chunk:]
         chunk1 = chunk1[:end_time_chunk]
@@ -312,233 +2323,577 @@ class SmartAudioSplitter:
         store[input_file1] = chunk1
         store[input_file2] = chunk2
 
-    def multiprocessing_task_add_pauses(self, input_file,
-                                        pause, store) -> None:
+    def calc_task_graph(self, n, how) -> Dict:
         """
-        The Task for the multiprocessing pool
-        Add pauses to the audio data and save
+        Calculate dependencies of tasks for multiprocessing pool.
+        Tasks of a part depend only on tasks of the part itself
+        and of its neighbours:
+        - ('load', i) loads part i
+        - ('split', i) splits parts i and i+1 by silence
+          (or by pauses of speech).
+          Splits with even i wait for the splits of neighbours,
+          because they change the same parts
+        - ('save', i) saves part i with pauses
+
         """
+        graph = {}
+        last_changes = {}
+        for i in range(1, n + 1):
+            graph[('load', i)] = []
+            last_changes[i] = [('load', i)]
+
+        if how in ('split_by_silence', 'split_by_vad'):
+            for i in range(1, n):
+                graph[('split', i)] = [('load', i), ('load', i + 1)]
+                if i % 2 == 0:
+                    graph[('split', i)].append(('split', i - 1))
+                    if i + 1 < n:
+                        graph[('split', i)].append(('split', i + 1))
 
-        chunk = store[input_file]
-        chunk = pause.append(chunk)
-        chunk = chunk.append(pause)
-        store[input_file] = chunk
+            for i in range(1, n + 1):
+                last_changes[i] = [('split', j) for j in (i - 1, i)
+                                   if 1 <= j < n] or last_changes[i]
 
-    def calc_tasks_for_pool(self, number_of_files) -> Tuple[List, List]:
-        """
-        Calculate sequence of tasks for multiprocessing pool.
-        We need two consecutive dependent iterations
-        """
+        for i in range(1, n + 1):
+            graph[('save', i)] = last_changes[i]
 
-        if number_of_files == 2:
-            iteration1 = [[1, 2]]
-            iteration2 = []
+        return graph
 
-            return iteration1, iteration2
+    def run_task_graph(self, graph, submit, n_jobs,
+                       store, on_done=None, n_encoders=None,
+                       sizes=None) -> None:
+        """
+        Run tasks of the graph as soon as their dependencies
+        are completed. Ready tasks of the first parts go first and
+        only 'n_jobs' tasks are submitted at once, so parts are
+        saved and freed while next parts are loading.
+        With 'n_encoders' save tasks are limited separately,
+        they are run by encoders, not by the worker pool.
+        With 'max_memory' a load task waits until its part (bytes
+        by 'sizes') fits the budget, a part is freed when it is saved;
+        if nothing is running, the next part is loaded anyway.
 
-        elif number_of_files == 3:
-            iteration1 = [[1, 2]]
-            iteration2 = [[2, 3]]
+        """
+        phases = {'load': 'prepare audio data',
+                  'split': 'split by silence',
+                  'save': 'save audio data',
+                  'file': 'split file'}
+        order = list(phases)
+
+        waiting = {task: len(deps) for task, deps in graph.items()}
+        dependants = {task: [] for task in graph}
+        for task, deps in graph.items():
+            for dep in deps:
+                dependants[dep].append(task)
+
+        # the first files (in the batch mode) and the first parts go first
+        def priority(task):
+            return task[2:], task[1], order.index(task[0]), task
+
+        def kind(task):
+            return 'save' if n_encoders and task[0] == 'save' else 'pool'
+
+        limits = {'pool': n_jobs, 'save': n_encoders}
+        ready = {'pool': [], 'save': []}
+        for task, count in waiting.items():
+            if not count:
+                ready[kind(task)].append(priority(task))
+        for tasks in ready.values():
+            heapq.heapify(tasks)
+
+        sizes = sizes if self.max_memory else {}
+        in_memory = 0
+
+        running = {}
+        started = {'pool': 0, 'save': 0}
+        finished = 0
+        len_all_tasks = len(graph)
+        while any(ready.values()) or running:
+            # running tasks of the cancelled job are stopped by workers
+            if self.cancel_token is not None and self.cancel_token.cancelled:
+                concurrent.futures.wait(running)
+                raise JobCancelled()
+
+            for name, tasks in ready.items():
+                waiting_memory = []
+                while tasks and started[name] < limits[name]:
+                    item = heapq.heappop(tasks)
+                    task = item[-1]
+                    if task in sizes:
+                        # back-pressure of the loader
+                        if running and in_memory + sizes[task] > self.max_memory:
+                            waiting_memory.append(item)
+                            continue
+                        in_memory += sizes[task]
+                    running[submit(task)] = task
+                    started[name] += 1
+                for item in waiting_memory:
+                    heapq.heappush(tasks, item)
+
+            completed, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in completed:
+                task = running.pop(future)
+                started[kind(task)] -= 1
+                if task[0] == 'save':
+                    in_memory -= sizes.get(('load',) + task[1:], 0)
+                self.check_task(future, task, store)
+
+                finished += 1
+                print(m := (f'\rProcessing task {finished} of {len_all_tasks} '
+                            f'(pool {phases[task[0]]}, part {task[1]})'), end=' ' * 20)
+                self.progress(store, tick=1, message=m[1:])
 
-            return iteration1, iteration2
+                if on_done is not None:
+                    on_done(task)
 
-        else:
-            left = number_of_files % 2
-            end = number_of_files - left
-            start = 1
-            tasks = {'iteration_1': [], 'iteration_2': []}
-            for start in [1, 2]:
-                for i in range(start, end + 1, 2):
-                    tasks[f'iteration_{start}'].append([i, i + 1])
-                end -= 1
+                for dependant in dependants[task]:
+                    waiting[dependant] -= 1
+                    if not waiting[dependant]:
+                        heapq.heappush(ready[kind(dependant)], priority(dependant))
 
-            if left:
-                tasks[f'iteration_2'].append([i + 2, i + 3])
+    def check_task(self, future, task, store) -> None:
+        """
+        Report and count the error of the finished task,
+        cancelled tasks are not errors
+        """
 
-            return tasks['iteration_1'], tasks['iteration_2']
+        if (exception := future.exception()) is None:
+            # workers which split whole files return their errors
+            if task[0] == 'file':
+                self.errors += future.result()
+
+        elif not isinstance(exception, JobCancelled):
+            self.errors += 1
+            print(f'{task}. An error was raised({exception}).\n')
+            self.progress(store, message=exception, warning=True)
 
     def progress(self, store, set_max=False, maximum=100,
                  tick=0, message='', warning=False) -> None:
         """
-        Progress bar / logger
+        Progress bar / logger. The state is kept by the instance
+        (ticks come from the process which set the maximum),
+        listeners get events by the channel, the store is not written.
         """
 
         if set_max:
-            store['progress_len'] = maximum
-            store['progress_tick'] = 1
+            self.progress_maximum = maximum
+            self.progress_tick = 1
+
+        progress_tick = None
+        if not warning and self.progress_tick:
+            self.progress_tick = progress_tick = self.progress_tick + tick
+
+        event = {'progress_len': self.progress_maximum,
+                 'progress_tick': progress_tick,
+                 'progress_message': str(message),
+                 'warning': warning}
+        if not self.channel.put(event) and self.log is not None:
+            # a worker of a pool which was started without the channel
+            self.log.write([{'time': time.time(), 'pid': os.getpid(), **event}])
+            self.log.close()
+
+    def print_progress_events(self, events) -> None:
+        """
+        Listener of the progress channel which prints
+        events to stderr as JSON lines
+        """
 
-        if not warning and (old_tick := store.get('progress_tick', False)):
-            store['progress_tick'] = old_tick + tick
+        for event in events:
+            print(json.dumps(event, default=str), file=sys.stderr, flush=True)
 
-        if warning:
-            store['progress_message'] = f'WARNING: {message}'
-        else:
-            store['progress_message'] = message
-
-        if self.log_to_file:
-            with open('info.log', 'a') as f:
-                progress_len = store.get('progress_len', None)
-                progress_tick = store.get('progress_tick', None)
-                progress_message = store.get('progress_message', None)
-                f.write(
-                    (f'{time.ctime()} {progress_len=}, '
-                     f'{progress_tick=}, '
-                     f'{progress_message=}\n'))
+    def count(self, name, value=1) -> None:
+        """
+        Add the value to the counter of the measured phase
+        of the current thread
+        """
+
+        counters = self.counters.setdefault(threading.get_ident(), {})
+        counters[name] = counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def measure(self, store, phase, part, input_file=None, submitted=None):
+        """
+        Measure wall and CPU time of the phase of the part and save
+        them with counters of the phase (bytes decoded and encoded,
+        silence retries) to the store by the key
+        'metrics:<input_file>:<phase>:<part>'.
+        CPU time is the time of the thread of the phase, so encoder
+        threads are not charged to other phases. CPU time of ffmpeg
+        is process-wide: it is counted when any ffmpeg process
+        of this process is finished during the phase.
+        Counters of nested phases are added to the outer phase,
+        phases of encoder threads are counted separately.
+        """
+
+        thread = threading.get_ident()
+        outer = self.counters.get(thread, {})
+        self.counters[thread] = {}
+        metrics = {'file': input_file, 'phase': phase, 'part': part,
+                   'pid': os.getpid(), 'start': time.time()}
+        if submitted is not None:
+            metrics['queue_wait'] = metrics['start'] - submitted
+
+        start_time = time.perf_counter()
+        start_thread_cpu = time.thread_time()
+        start_cpu = os.times()
+        try:
+            yield metrics
+
+        finally:
+            cpu = os.times()
+            metrics['wall'] = time.perf_counter() - start_time
+            metrics['cpu'] = time.thread_time() - start_thread_cpu
+            metrics['cpu_children'] = (
+                cpu.children_user - start_cpu.children_user +
+                cpu.children_system - start_cpu.children_system)
+            counters = self.counters[thread]
+            metrics.update(counters)
+
+            for name, value in counters.items():
+                outer[name] = outer.get(name, 0) + value
+            self.counters[thread] = outer
+
+            store[f'metrics:{input_file}:{phase}:{part}'] = metrics
+
+    def get_metrics(self, store) -> List[Dict]:
+        """
+        Return metrics of all measured phases from the store
+        """
+
+        return [store.get(key) for key in list(store.keys())
+                if isinstance(key, str) and key.startswith('metrics:')]
+
+    def get_noise_floors(self, store) -> Dict:
+        """
+        Return noise floor estimates of split points
+        ('<file>:<part>') and of planning ('<file>:plan')
+        """
+
+        return {key[len('noise_floor:'):]: store.get(key)
+                for key in list(store.keys())
+                if isinstance(key, str) and key.startswith('noise_floor:')}
+
+    def clear_metrics(self, store) -> None:
+        """
+        Remove metrics and noise floor estimates
+        of the previous run from the store
+        """
+
+        for key in list(store.keys()):
+            if isinstance(key, str) and key.startswith(('metrics:', 'noise_floor:')):
+                del store[key]
+
+    def metrics_text(self, store) -> str:
+        """
+        Return metrics in the Prometheus text format
+        """
+
+        fields = {'wall': ('phase_wall_seconds',
+                           'Wall time of the phase.'),
+                  'cpu': ('phase_cpu_seconds',
+                          'CPU time of the thread of the phase.'),
+                  'cpu_children': ('phase_ffmpeg_cpu_seconds',
+                                   'CPU time of ffmpeg processes finished in '
+                                   'the phase (process-wide, phases running '
+                                   'at once share it).'),
+                  'queue_wait': ('pool_queue_wait_seconds',
+                                 'Time from submitting the task to its start.'),
+                  'bytes_decoded': ('decoded_bytes',
+                                    'Decoded PCM data.'),
+                  'bytes_encoded': ('encoded_bytes',
+                                    'Size of saved files.'),
+                  'silence_retries': ('silence_retries',
+                                      'Increases of the silence threshold.')}
+
+        def escape(value):
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+            return value.replace('\n', '\\n')
+
+        metrics = sorted(self.get_metrics(store),
+                         key=lambda metric: metric['start'])
+        lines = []
+        for field, (name, help_text) in fields.items():
+            name = f'smart_audio_splitter_{name}'
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for metric in metrics:
+                if field not in metric:
+                    continue
+                labels = ','.join(
+                    f'{label}="{escape(metric[label])}"'
+                    for label in ('file', 'phase', 'part'))
+                lines.append(f'{name}{{{labels}}} {metric[field]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def calc_pool_tasks(self, input_file,
+                        n, add_pause, pause_len, silence_len,
+                        how, out_filename, format_,
+                        bitrate, tags, store, pool,
+                        parameters=None, file_key=None) -> Tuple:
+        """
+        Calculate the graph of tasks of the file for the pool
+        and return it with functions which submit a task and
+        free the part after saving and sizes of decoded parts
+        by load tasks (for the memory budget).
+        With 'file_key' tasks and chunks of many files
+        can be run in one graph and one store.
+
+        """
+
+        # Get duration of audio data
+        if parameters is None:
+            parameters = self.get_parameters(input_file)
+        duration = self.calc_duration(parameters)
+
+        # Decode the file to the cache once
+        self.prepare_pcm_cache(input_file, parameters)
+
+        # Calc time intervals
+        chunks_times = self.calc_parts_times(input_file, n, duration)
+
+        graph = self.calc_task_graph(n, how)
+
+        # parts exported by the previous run of the job
+        # (they are planned, so they do not depend on other parts)
+        exported = self.done_parts(out_filename)
+        graph = {task: deps for task, deps in graph.items()
+                 if task[1] not in exported}
+
+        if file_key is not None:
+            graph = {task + (file_key,): [dep + (file_key,) for dep in deps]
+                     for task, deps in graph.items()}
+
+        # PCM data of parts, at least three parts (a part and its
+        # neighbours) are in memory, bigger parts are spilled to disk
+        frame_rate, channels = self.get_audio_format(parameters)
+        sizes = {}
+        for i, (start, end) in enumerate(chunks_times, start=1):
+            task = ('load', i) if file_key is None else ('load', i, file_key)
+            sizes[task] = int((end - start) * frame_rate) * channels * 2
+        spill = {task[1] for task, size in sizes.items()
+                 if self.max_memory and size * 3 > self.max_memory}
+        if isinstance(store, SharedChunkStore):
+            # spilled parts are on disk, they do not take the budget
+            sizes = {task: 0 if task[1] in spill else size
+                     for task, size in sizes.items()}
+
+        encoders = self.get_encoders(self.n_encoders)
+
+        def key(i):
+            return i if file_key is None else (file_key, i)
+
+        def submit(task):
+            phase, i = task[:2]
+            # tasks are measured by workers, the submit time gives queue wait
+            measured = (store, phase, i, input_file, time.time())
+            if phase == 'load':
+                start, end = chunks_times[i - 1]
+                return pool.submit(self.multiprocessing_task, measured,
+                                   'multiprocessing_task_load_save',
+                                   input_file, start, end, key(i), store,
+                                   i in spill)
+
+            elif phase == 'split':
+                return pool.submit(self.multiprocessing_task, measured,
+                                   'multiprocessing_task_split_by_silence',
+                                   key(i), key(i + 1), silence_len, store,
+                                   f'{input_file}:{i}')
+
+            elif phase == 'save':
+                # parts are encoded by threads of this process
+                # which stream shared memory to ffmpeg
+                return encoders.submit(self.multiprocessing_task, measured,
+                                       'save_data',
+                                       chunk=None, n=i, file_name=out_filename,
+                                       format_=format_, bitrate=bitrate, tags=tags,
+                                       store=store, key=key(i),
+                                       pause_len=pause_len if add_pause else 0)
+
+        def free_part(task):
+            phase, i = task[:2]
+            if phase == 'save':
+                if isinstance(store, SharedChunkStore):
+                    store.release(key(i))
+                else:
+                    store.pop(key(i), None)
+
+        return graph, submit, free_part, sizes
 
     def multiprocessing_split_pool(self, input_file,
                                    n, add_pause, pause_len, silence_len,
                                    n_jobs, how, out_filename, format_,
                                    bitrate, tags, store) -> None:
         """
-        Processing data with the multiprocessing pools:
+        Processing data with the multiprocessing pool:
         - Get duration
         - Calc time intervals
-        - Load data by chunks pool
-        - Detect silence pool(2 iteration)
-        - Add pause pool
-        - Save file pool
+        - Calc the graph of tasks
+        - Load data by chunks, detect silence and save file
+          with pauses for every part as soon as its neighbours allow
 
         """
 
-        # Get duration of audio data
-        parameters = self.get_parameters(input_file)
-        if 'duration' in parameters:
-            duration = float(parameters['duration'])
-        elif 'ffprobe_duration' in parameters:
-            duration = float(parameters['ffprobe_duration'])
+        # one pool for all phases
+        pool = self.get_pool(n_jobs)
 
-        # Calc time intervals
-        chunks_times = self.calc_list_of_parts(n, duration)
-
-        if how == 'raw_split':
-            # calc the total number of tasks
-            len_all_tasks = n + n * add_pause + n
-
-            # save progress
-            self.progress(store, set_max=True, maximum=len_all_tasks)
-
-            # split audio into N equal parts
-            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
-
-                futures = {}
-                for i, (start, end) in enumerate(chunks_times, start=1):
-                    futures[pool.submit(self.multiprocessing_task_load_save,
-                                        input_file, start, end, i, store)] = (i, (start, end))
-
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    if (exception := future.exception()) is not None:
-                        print(f'{futures[future]}. An error was raised({exception}).\n')
-                        self.progress(store, message=exception, warning=True)
-
-                    print(m := (f'\rProcessing task {i} of {len_all_tasks} '
-                                f'(pool prepare audio data)'), end=' ' * 20)
-                    self.progress(store, tick=1, message=m[1:])
-                last_iter = i
-
-        elif how == 'split_by_silence':
-
-            # calc the total number of tasks
-            iteration_1, iteration_2 = self.calc_tasks_for_pool(n)
-            len_all_tasks = (n + len(iteration_1) +
-                             len(iteration_2) + n * add_pause + n)
-
-            # save progress
-            self.progress(store, set_max=True, maximum=len_all_tasks)
-
-            # load and split data by chunks
-            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
-
-                futures = {}
-                for i, (start, end) in enumerate(chunks_times, start=1):
-                    futures[pool.submit(self.multiprocessing_task_load_save,
-                                        input_file,
-                                        start, end,
-                                        i, store)] = (i, (start, end))
-
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    if (exception := future.exception()) is not None:
-                        print(f'{futures[future]}. An error was raised({exception}).\n')
-                        self.progress(store, message=exception, warning=True)
-
-                    print(m := (f'\rProcessing task {i} of {len_all_tasks} '
-                                f'(pool prepare audio data)'), end=' ' * 20)
-                    self.progress(store, tick=1, message=m[1:])
-                last_iter = i
-
-            # split by silence
-            # do iteration 1 after completing load and split data by chunks
-            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
-
-                futures = {}
-                for task in iteration_1:
-                    futures[pool.submit(self.multiprocessing_task_split_by_silence,
-                                        task[0], task[1], silence_len, store)] = (task[0], task[1])
-
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    if (exception := future.exception()) is not None:
-                        print(f'{futures[future]}. An error was raised({exception}).\n')
-                        self.progress(store, message=exception, warning=True)
-
-                    print(m := (f'\rProcessing task {last_iter + i} of {len_all_tasks} '
-                                f'(pool split by silence iteration 1)'), end=' ' * 20)
-                    self.progress(store, tick=1, message=m[1:])
-                last_iter += i
-
-                # do iteration 2 after completing iteration 1
-            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
-                futures = {}
-                for task in iteration_2:
-                    futures[pool.submit(self.multiprocessing_task_split_by_silence,
-                                        task[0], task[1], silence_len, store)] = (task[0], task[1])
-
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    if (exception := future.exception()) is not None:
-                        print(f'{futures[future]}. An error was raised({exception}).\n')
-                        self.progress(store, message=exception, warning=True)
-
-                    print(m := (f'\rProcessing task {last_iter + i} of {len_all_tasks} '
-                                f'(pool split by silence iteration 2)'), end=' ' * 20)
-                    self.progress(store, tick=1, message=m[1:])
-                last_iter += i
-
-        # add pauses after 'raw_split' or 'split_by_silence'
-        if add_pause:
+        graph, submit, free_part, sizes = self.calc_pool_tasks(
+            input_file, n, add_pause, pause_len, silence_len,
+            how, out_filename, format_, bitrate, tags, store, pool)
 
-            silents = pydub.AudioSegment.silent(duration=pause_len)
-            with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        # save progress
+        self.progress(store, set_max=True, maximum=len(graph))
 
-                futures = {}
-                for i in range(1, n + 1):
-                    futures[pool.submit(self.multiprocessing_task_add_pauses,
-                                        i, silents, store)] = i
+        self.run_task_graph(graph, submit, n_jobs, store,
+                            on_done=free_part, n_encoders=self.n_encoders,
+                            sizes=sizes)
 
-                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                    if (exception := future.exception()) is not None:
-                        print(f'{futures[future]}. An error was raised({exception}).\n')
-                        self.progress(store, message=exception, warning=True)
+        # free shared memory after saving
+        if isinstance(store, SharedChunkStore):
+            store.release()
 
-                    print(m := (f'\rProcessing task {last_iter + i} of {len_all_tasks} '
-                                f'(pool add pause)'), end=' ' * 20)
-                    self.progress(store, tick=1, message=m[1:])
-                last_iter += i
+        self.progress(store, message='Done')
 
-        # save audio data to files for 'raw_split' or 'split_by_silence'
-        with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
-            futures = {}
-            for i in range(1, n + 1):
-                futures[pool.submit(
-                    self.save_data,
-                    chunk=None, n=i, file_name=out_filename,
-                    format_=format_, bitrate=bitrate, tags=tags,
-                    store=store)] = i
-
-            for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
-                if (exception := future.exception()) is not None:
-                    print(f'{futures[future]}. An error was raised({exception}).\n')
-                    self.progress(store, message=exception, warning=True)
-
-                print(m := (f'\rProcessing task {last_iter + i} of {len_all_tasks} '
-                            f'(pool save audio data)'), end=' ' * 20)
-                self.progress(store, tick=1, message=m[1:])
 
-        self.progress(store, message='Done')
+def main(args=None) -> None:
+    """
+    Command-line entry point, it does not need a display:
+    python SmartAudioSplitter.py book.mp3 -n 4
+    python SmartAudioSplitter.py podcasts/ -o parts/part -j 8 --json-progress
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Split large audio files into parts by silence.')
+    parser.add_argument('input',
+                        help='audio file, directory or glob pattern (batch mode)')
+    parser.add_argument('-o', '--out-filename', default='part',
+                        help='name of output files (without the part number)')
+    parser.add_argument('-n', '--n-split', type=int, default=4,
+                        help='how many parts to split')
+    parser.add_argument('-d', '--part-duration', type=float, default=None,
+                        help='target duration of parts in seconds (instead of -n)')
+    parser.add_argument('--how', default='split_by_silence',
+                        choices=['split_by_silence', 'raw_split',
+                                 'split_by_duration', 'split_by_vad'],
+                        help=('split by silence, into equal parts, by silence '
+                              'planned for the part duration of the whole file '
+                              'or by pauses of speech (voice activity)'))
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help=('max deviation of parts from the mean length '
+                              'in seconds for split_by_duration (1/5 of the part)'))
+    parser.add_argument('--silence-index', action='store_true',
+                        help=('save the silence map next to the file (.silence.npz) '
+                              'and plan split points by it in next runs'))
+    parser.add_argument('--silence-len', type=int, default=500,
+                        help='minimal silence length in ms')
+    parser.add_argument('--level-dBFS', default='auto',
+                        help="silence threshold in dBFS, 'auto' (by the "
+                             "noise floor) or 'calc' (by loudness)")
+    parser.add_argument('--no-pause', dest='add_pause', action='store_false',
+                        help='do not add pauses to parts')
+    parser.add_argument('--pause-len', type=int, default=2000,
+                        help='pause length in ms')
+    parser.add_argument('-f', '--format', dest='format_', default='mp3',
+                        help='output format (mp3, wav, flac, opus, ogg, aac, m4a, m4b)')
+    parser.add_argument('-b', '--bitrate', default='128k',
+                        help='output bitrate')
+    parser.add_argument('-t', '--tag', action='append', default=[],
+                        metavar='KEY=VALUE', help='output tag (repeatable)')
+    parser.add_argument('-j', '--n-jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-e', '--n-encoders', type=int, default=None,
+                        help='number of parallel ffmpeg encoders (as -j)')
+    parser.add_argument('--no-multiprocessing', dest='multiprocessing_on',
+                        action='store_false',
+                        help='process in one process')
+    parser.add_argument('--streaming', action='store_true',
+                        help='decode the file once and keep only a few blocks in memory')
+    parser.add_argument('--lossless', action='store_true',
+                        help='cut raw_split parts without re-encoding')
+    parser.add_argument('--pcm-cache', nargs='?', const='', default=None,
+                        metavar='DIR', help='cache decoded audio on disk')
+    parser.add_argument('--pcm-cache-size', type=float, default=5,
+                        help='max size of the PCM cache in GB')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='max size of decoded parts in memory in GB '
+                             '(bigger parts are spilled to disk)')
+    parser.add_argument('--spill-dir', default=None, metavar='DIR',
+                        help='directory of temp files of spilled parts '
+                             '(the temp dir, it can be in memory)')
+    parser.add_argument('--analysis-rate', type=int, default=8000,
+                        help='frame rate of the mono stream for silence detection '
+                             '(0 is the source format)')
+    parser.add_argument('--resume', action='store_true',
+                        help='keep the job manifest and skip exported parts on restart')
+    parser.add_argument('--log-to-file', nargs='?', const=True, default=False,
+                        metavar='FILE',
+                        help='write progress to the log file as JSON lines (info.log)')
+    parser.add_argument('--json-progress', action='store_true',
+                        help='write progress to stderr as JSON lines')
+    parser.add_argument('--metrics', dest='metrics_file', default=None,
+                        metavar='FILE',
+                        help='save metrics of phases in the Prometheus text format')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print progress to stdout')
+    options = parser.parse_args(args)
+
+    level_dBFS = options.level_dBFS
+    if level_dBFS not in ('calc', 'auto'):
+        level_dBFS = float(level_dBFS)
+
+    tags = None
+    if options.tag:
+        tags = dict(tag.split('=', 1) for tag in options.tag)
+
+    pcm_cache = None
+    if options.pcm_cache is not None:
+        from PcmCache import PcmCache
+        pcm_cache = PcmCache(cache_dir=options.pcm_cache or None,
+                             max_size=int(options.pcm_cache_size * 1024 ** 3))
+
+    max_memory = None
+    if options.max_memory is not None:
+        max_memory = int(options.max_memory * 1024 ** 3)
+
+    if options.quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+    with SmartAudioSplitter(options.input,
+                            add_pause=options.add_pause,
+                            pause_len=options.pause_len,
+                            silence_len=options.silence_len,
+                            level_dBFS=level_dBFS,
+                            multiprocessing_on=options.multiprocessing_on,
+                            n_split=options.n_split,
+                            n_jobs=options.n_jobs,
+                            how=options.how,
+                            out_filename=options.out_filename,
+                            format_=options.format_,
+                            bitrate=options.bitrate,
+                            tags=tags,
+                            log_to_file=options.log_to_file,
+                            streaming=options.streaming,
+                            lossless=options.lossless,
+                            pcm_cache=pcm_cache,
+                            part_duration=options.part_duration,
+                            json_progress=options.json_progress,
+                            metrics_file=options.metrics_file,
+                            tolerance=options.tolerance,
+                            silence_index=options.silence_index,
+                            n_encoders=options.n_encoders,
+                            max_memory=max_memory,
+                            spill_dir=options.spill_dir,
+                            resume=options.resume,
+                            analysis_rate=options.analysis_rate or None) as worker:
+        worker.run()
+
+    # scripts see failed tasks by the exit code
+    if worker.errors:
+        sys.exit(1)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+import os
+import re
+import json
+import time
+import wave
+import glob
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import concurrent.futures
+import multiprocessing
+import numpy as np
+from typing import List, Dict, Tuple
+from SmartAudioSplitter import SmartAudioSplitter
+from SharedChunkStore import SharedChunkStore
+
+
+class SmartAudioSplitterBenchmark(SmartAudioSplitter):
+    """
+    SmartAudioSplitterBenchmark times the split pipelines on
+    synthetic speech-like fixtures with known silence positions.
+    Every case runs in a new process, so the peak RSS is measured
+    for the case only. Results are saved to a JSON file which
+    can be compared with results of other commits.
+
+    """
+
+    # 'silence' is the detection of split points (the search of
+    # the streaming mode too), pauses are written by encoders, so they
+    # are in 'export'; the streaming mode writes to encoders while
+    # decoding, its export is the rest of the total
+    phases = ('probe', 'decode', 'silence', 'export')
+
+    def __init__(self, work_dir='benchmark',
+                 lengths=('1m', '1h', '10h'), formats=('wav', 'mp3'),
+                 modes=('single', 'multiprocessing'),
+                 frame_rate=44100, seed=0, **kwargs):
+
+        # the store is created by the case process
+        kwargs.setdefault('store', dict())
+        super().__init__(full_filename='', **kwargs)
+
+        self.work_dir = work_dir
+        self.lengths = lengths
+        self.formats = formats
+        self.modes = modes
+        # fixtures are mono, 10 hours of stereo 44.1 kHz
+        # do not fit the 4 GB limit of the WAV file
+        self.frame_rate = frame_rate
+        self.seed = seed
+        self.timings = None
+        # only the outermost call of the split point detection is timed
+        self.detecting = False
+
+    def parse_length(self, length) -> int:
+        """
+        Parse the fixture length like '90', '1m', '1h' to seconds
+        """
+
+        if match := re.fullmatch(r'([\d\.]+)([smh]?)', str(length)):
+            value, unit = match.groups()
+            return int(float(value) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[unit])
+
+        raise ValueError(f'Wrong length of the fixture: {length}')
+
+    def make_sentence(self, rng) -> np.ndarray:
+        """
+        Make a speech-like sentence: words are harmonic tones with
+        syllable envelopes, pauses between words are shorter than
+        the default 'silence_len'
+        """
+
+        signal = []
+        for _ in range(rng.integers(4, 16)):
+            duration = rng.uniform(0.15, 0.6)
+            t = np.arange(int(duration * self.frame_rate)) / self.frame_rate
+            f0 = rng.uniform(90, 250) * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))
+            phase = 2 * np.pi * np.cumsum(f0) / self.frame_rate
+            word = sum(np.sin(k * phase) / k for k in range(1, 6))
+            word *= np.sin(np.pi * t / duration) ** 0.5
+            word *= 0.6 + 0.4 * np.sin(np.pi * t * rng.uniform(3, 6)) ** 2
+            signal.append(word * rng.uniform(0.1, 0.4))
+            signal.append(np.zeros(int(rng.uniform(0.05, 0.25) * self.frame_rate)))
+
+        return np.concatenate(signal)
+
+    def make_fixture(self, length, format_='wav') -> Tuple[str, List]:
+        """
+        Make the fixture file (or take it from the work dir) and
+        return its name with the list of silences (start, end) in ms
+        """
+
+        seconds = self.parse_length(length)
+        os.makedirs(self.work_dir, exist_ok=True)
+        file_name = os.path.join(self.work_dir, f'fixture_{seconds}s.wav')
+        silences_file = os.path.join(self.work_dir, f'fixture_{seconds}s.json')
+
+        if not (os.path.exists(file_name) and os.path.exists(silences_file)):
+            print(f'Making the fixture {file_name}')
+            rng = np.random.default_rng(self.seed)
+            total = seconds * self.frame_rate
+            position = 0
+            silences = []
+            with wave.open(f'{file_name}.tmp', 'wb') as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(self.frame_rate)
+
+                while position < total:
+                    pause = int(rng.uniform(0.7, 2.0) * self.frame_rate)
+                    data = np.concatenate((self.make_sentence(rng),
+                                           np.zeros(pause)))
+                    start = position + len(data) - pause
+                    end = position + len(data)
+                    if end <= total:
+                        silences.append((start * 1000 // self.frame_rate,
+                                         end * 1000 // self.frame_rate))
+
+                    # the noise floor is about -60 dBFS
+                    data = data[:total - position]
+                    data += rng.normal(0, 0.001, len(data))
+                    data = np.clip(data * 32767, -32768, 32767)
+                    f.writeframes(data.astype('<i2').tobytes())
+                    position += len(data)
+
+            with open(silences_file, 'w') as f:
+                json.dump(silences, f)
+            os.replace(f'{file_name}.tmp', file_name)
+
+        with open(silences_file) as f:
+            silences = [tuple(silence) for silence in json.load(f)]
+
+        if format_ != 'wav':
+            wav_file = file_name
+            file_name = f'{os.path.splitext(wav_file)[0]}.{format_}'
+            if not os.path.exists(file_name):
+                print(f'Making the fixture {file_name}')
+                args = ('ffmpeg', '-y', '-v', 'error', '-i', wav_file,
+                        '-b:a', '128k', f'{file_name}.tmp.{format_}')
+                subprocess.run(args, check=True)
+                os.replace(f'{file_name}.tmp.{format_}', file_name)
+
+        return file_name, silences
+
+    def add_timing(self, phase, start_time) -> None:
+        """
+        Add the time of the phase. Keys are per process,
+        so workers do not overwrite times of each other.
+        """
+
+        if self.timings is not None:
+            key = (phase, os.getpid())
+            self.timings[key] = (self.timings.get(key, 0) +
+                                 time.perf_counter() - start_time)
+
+    def get_parameters(self, input_file) -> Dict:
+        start_time = time.perf_counter()
+        try:
+            return super().get_parameters(input_file)
+        finally:
+            self.add_timing('probe', start_time)
+
+    def load_chunk(self, input_file, start_second, duration):
+        start_time = time.perf_counter()
+        try:
+            return super().load_chunk(input_file, start_second, duration)
+        finally:
+            self.add_timing('decode', start_time)
+
+    def decode_stream(self, input_file, frame_rate, channels,
+                      block_len=10000, start_second=0, duration=None):
+        blocks = super().decode_stream(input_file, frame_rate, channels,
+                                       block_len, start_second, duration)
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    data = next(blocks, None)
+                finally:
+                    self.add_timing('decode', start_time)
+                if data is None:
+                    return
+                yield data
+        finally:
+            blocks.close()
+
+    def time_detection(self, method, *args) -> float:
+        """
+        Time the split point detection as the 'silence' phase
+        """
+
+        if self.detecting:
+            return method(*args)
+
+        self.detecting = True
+        start_time = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.detecting = False
+            self.add_timing('silence', start_time)
+
+    def detect_split_point(self, chunk, min_silence_len=500,
+                           store=None, key=None) -> float:
+        return self.time_detection(super().detect_split_point, chunk,
+                                   min_silence_len, store, key)
+
+    def find_split_point(self, envelope, regions, min_silence_len,
+                         silence_thresh, store=None, key=None) -> float:
+        return self.time_detection(super().find_split_point, envelope, regions,
+                                   min_silence_len, silence_thresh, store, key)
+
+    def find_pause(self, window, regions, min_pause_len,
+                   store=None, key=None) -> float:
+        return self.time_detection(super().find_pause, window, regions,
+                                   min_pause_len, store, key)
+
+    def save_data(self, chunk, n, file_name, format_='mp3', bitrate='128k',
+                  tags=None, store=None, key=None, pause_len=0) -> None:
+        start_time = time.perf_counter()
+        try:
+            return super().save_data(chunk, n, file_name, format_,
+                                     bitrate, tags, store, key, pause_len)
+        finally:
+            self.add_timing('export', start_time)
+
+    def calc_cuts(self, parts) -> List[float]:
+        """
+        Calc split points (ms) of the source by durations of parts
+        """
+
+        self.timings = None
+        durations = [self.calc_duration(self.get_parameters(part)) * 1000
+                     for part in parts]
+        if self.add_pause:
+            durations = [duration - 2 * self.pause_len for duration in durations]
+
+        return [float(cut) for cut in np.cumsum(durations)[:-1]]
+
+    def run_case(self, input_file, silences, mode) -> Dict:
+        """
+        Split the fixture in the mode and return times of phases
+        (summed over processes), the total time and the peak RSS
+        """
+
+        out_dir = os.path.join(self.work_dir, 'out')
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+
+        self.full_filename = input_file
+        self.out_filename = os.path.join(out_dir, 'part')
+        self.multiprocessing_on = mode == 'multiprocessing'
+        self.streaming = mode == 'streaming'
+        self.store = (SharedChunkStore(spill_dir=self.spill_dir)
+                      if self.multiprocessing_on else dict())
+
+        manager = multiprocessing.Manager()
+        self.timings = manager.dict()
+
+        start_time = time.perf_counter()
+        cpu_time = time.process_time()
+        self.run()
+        total = time.perf_counter() - start_time
+        cpu_time = time.process_time() - cpu_time
+        self.close()
+
+        # metrics of tasks from the store of the splitter
+        metrics = self.get_metrics(self.store)
+
+        phases = dict.fromkeys(self.phases, 0.0)
+        for (phase, _), seconds in self.timings.items():
+            phases[phase] = phases.get(phase, 0.0) + seconds
+        manager.shutdown()
+        if self.streaming:
+            phases['export'] = max(total - sum(phases.values()), 0.0)
+
+        # ru_maxrss is in KB on Linux, children are workers and ffmpeg
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+        parts = sorted(glob.glob(f'{self.out_filename}_*'),
+                       key=lambda part: int(part.rsplit('_', 1)[1]))
+        cuts = self.calc_cuts(parts)
+        # encoders of compressed formats add some ms
+        # of padding to every part
+        cuts_in_silence = sum(
+            any(start - 50 * i <= cut <= end + 50 * i
+                for start, end in silences)
+            for i, cut in enumerate(cuts, start=1))
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+        return {'phases': phases,
+                'total': total,
+                'main_cpu_time': cpu_time,
+                'peak_rss_mb': peak_rss / 1024,
+                'parts': len(parts),
+                'cuts': cuts,
+                'cuts_in_silence': cuts_in_silence,
+                'metrics': metrics}
+
+    def get_commit(self) -> str:
+        """
+        Return the git commit of the repository or None
+        """
+
+        try:
+            return subprocess.run(('git', 'rev-parse', '--short', 'HEAD'),
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run_benchmark(self, results_file='benchmark.json') -> Dict:
+        """
+        Run all cases (length x format x mode) and save results
+        """
+
+        results = {'version': self.version,
+                   'commit': self.get_commit(),
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'cpu_count': multiprocessing.cpu_count(),
+                   'parameters': {'n_split': self.n_split,
+                                  'n_jobs': self.n_jobs,
+                                  'how': self.how,
+                                  'format_': self.format_,
+                                  'bitrate': self.bitrate,
+                                  'silence_len': self.silence_len,
+                                  'pause_len': self.pause_len,
+                                  'add_pause': self.add_pause,
+                                  'frame_rate': self.frame_rate},
+                   'cases': []}
+
+        # cases run in new processes, so peak RSS of every case is clean
+        context = multiprocessing.get_context('spawn')
+        for length in self.lengths:
+            for format_ in self.formats:
+                input_file, silences = self.make_fixture(length, format_)
+                for mode in self.modes:
+                    print(f'\nBenchmark: {length} {format_} {mode}')
+                    with concurrent.futures.ProcessPoolExecutor(
+                            max_workers=1, mp_context=context) as executor:
+                        case = executor.submit(self.run_case, input_file,
+                                               silences, mode).result()
+
+                    case = {'length': self.parse_length(length),
+                            'format': format_,
+                            'mode': mode,
+                            'silences': len(silences),
+                            **case}
+                    results['cases'].append(case)
+                    print(f'\nTotal {case["total"]:.2f} s, '
+                          f'peak RSS {case["peak_rss_mb"]:.0f} MB, '
+                          f'{case["cuts_in_silence"]} of {len(case["cuts"])} '
+                          f'cuts in silence')
+
+                    # results are saved after every case
+                    with open(results_file, 'w') as f:
+                        json.dump(results, f, indent=2)
+
+        return results
+
+    @staticmethod
+    def compare(old_file, new_file) -> None:
+        """
+        Print times and peak RSS of two results files side by side
+        """
+
+        cases = []
+        for results_file in (old_file, new_file):
+            with open(results_file) as f:
+                results = json.load(f)
+            cases.append({(case['length'], case['format'], case['mode']): case
+                          for case in results['cases']})
+
+        old_cases, new_cases = cases
+        for key in sorted(old_cases.keys() & new_cases.keys()):
+            old, new = old_cases[key], new_cases[key]
+            print(f'{key[0]} s {key[1]} {key[2]}:')
+            rows = [('total', old['total'], new['total'])]
+            rows += [(phase, old['phases'].get(phase, 0), new['phases'].get(phase, 0))
+                     for phase in SmartAudioSplitterBenchmark.phases]
+            rows += [('peak_rss_mb', old['peak_rss_mb'], new['peak_rss_mb'])]
+            for name, old_value, new_value in rows:
+                ratio = new_value / old_value if old_value else float('nan')
+                print(f'    {name:<12} {old_value:>10.2f} {new_value:>10.2f} '
+                      f'{ratio:>8.2f}x')
+
+
+def main(args=None) -> None:
+    """
+    python SmartAudioSplitterBenchmark.py -l 1m 1h -o before.json
+    python SmartAudioSplitterBenchmark.py --compare before.json after.json
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark of SmartAudioSplitter on synthetic fixtures.')
+    parser.add_argument('-l', '--lengths', nargs='+', default=['1m', '1h', '10h'],
+                        help='lengths of fixtures (90, 1m, 1h, 10h)')
+    parser.add_argument('--formats', nargs='+', default=['wav', 'mp3'],
+                        help='formats of fixtures')
+    parser.add_argument('--modes', nargs='+',
+                        default=['single', 'multiprocessing'],
+                        choices=['single', 'multiprocessing', 'streaming'],
+                        help='pipelines to run')
+    parser.add_argument('-n', '--n-split', type=int, default=4,
+                        help='how many parts to split')
+    parser.add_argument('-j', '--n-jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-f', '--format', dest='format_', default='mp3',
+                        help='output format')
+    parser.add_argument('-w', '--work-dir', default='benchmark',
+                        help='directory of fixtures and outputs')
+    parser.add_argument('-o', '--results', default='benchmark.json',
+                        help='results file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two results files')
+    options = parser.parse_args(args)
+
+    if options.compare:
+        SmartAudioSplitterBenchmark.compare(*options.compare)
+        return
+
+    benchmark = SmartAudioSplitterBenchmark(work_dir=options.work_dir,
+                                            lengths=options.lengths,
+                                            formats=options.formats,
+                                            modes=options.modes,
+                                            n_split=options.n_split,
+                                            n_jobs=options.n_jobs,
+                                            format_=options.format_)
+    benchmark.run_benchmark(options.results)
+
+
+if __name__ == '__main__':
+    main()
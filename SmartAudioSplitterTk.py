@@ -1,5 +1,4 @@
 import os
-import time
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import ttk
@@ -9,7 +8,13 @@ import re
 import webbrowser
 import multiprocessing
 import threading
+import concurrent.futures
+import numpy as np
 from SmartAudioSplitter import SmartAudioSplitter
+from SharedChunkStore import SharedChunkStore
+from PcmCache import PcmCache
+from MediaInfoCache import MediaInfoCache
+from CancelToken import CancelToken
 
 
 class SmartAudioSplitterTk(SmartAudioSplitter):
@@ -25,7 +30,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         # set engine
         self.root = tk.Tk()
         self.root.title('Smart Audio Splitter')
-        self.root.geometry("1200x520+300+300")
+        self.root.geometry("1200x680+300+300")
         self.root.resizable(False, False)
 
         # set fonts
@@ -55,12 +60,37 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         self.n_cores = tk.StringVar(value='all cores')
         self.progress_len = tk.IntVar(value=1)
 
+        # the waveform is drawn from the peak pyramid of the file,
+        # 'view' is the visible interval (seconds)
+        self.peak_pyramid = None
+        self.view = (0, 0)
+        self.split_points = []
+        self.drag = None
+        self.waveform_message = ''
+        self.overview_pool = None
+
+        # decoded audio is cached for next runs with other params
+        self.pcm_cache = PcmCache()
+
+        # files are probed once for the window and for runs
+        self.media_info = MediaInfoCache(os.path.join(
+            os.path.dirname(self.pcm_cache.cache_dir), 'media_info.json'))
+
+        # the job is cancelled by the button, restarted jobs
+        # skip parts which are exported already
+        self.cancel_token = CancelToken()
+
     def start(self):
         self.create_step1()
+        self.create_waveform()
         self.create_step2()
         self.create_step3()
         self.root.mainloop()
 
+        if self.overview_pool is not None:
+            self.overview_pool.shutdown(wait=False, cancel_futures=True)
+        self.close()
+
     def open_file_dialog(self):
         filename = filedialog.askopenfilename(
             initialdir=os.getcwd(),
@@ -81,19 +111,15 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
     def set_input_params(self):
         self.params_dict = self.get_parameters(self.full_filename)
 
-        if 'ffprobe_duration' in self.params_dict:
-            format_ = '##'
-            rate = '##'
-            channels = '##'
-            bt = '##'
-            self.duration = float(self.params_dict['ffprobe_duration'])
-
-        else:
-            format_ = self.params_dict['format_name'][:10]
+        format_ = self.params_dict.get('format_name', '##')[:10]
+        rate = channels = bt = '##'
+        if 'sample_rate' in self.params_dict:
             rate = int(self.params_dict['sample_rate']) // 1000
+        if 'channels' in self.params_dict:
             channels = self.params_dict['channels']
+        if 'bit_rate' in self.params_dict:
             bt = int(self.params_dict['bit_rate']) // 1000
-            self.duration = float(self.params_dict['duration'])
+        self.duration = float(self.params_dict['duration'])
 
         self.in_format.set(
             value=f'Format: {format_} {bt}kbit/s {rate}khz {channels} channels')
@@ -103,6 +129,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         self.duration_label.set(
             value=f'Duration: {h:.0f}h : {m:.0f}m : {s:.01f}s')
 
+        self.load_overview()
         self.parts_calc()
 
         output_name = re.findall(
@@ -117,6 +144,142 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         self.ncut_calc.set(
             value=f'(part is ~{h:.0f}h : {m:.0f}m : {s:.01f}s)')
 
+        # the silence index of the file (it is saved by previous runs)
+        # gives split points without decoding
+        if self.full_filename and self.split_by_silence.get():
+            preview = SmartAudioSplitter(
+                full_filename=self.full_filename,
+                silence_len=self.silence_len.get(),
+                n_split=self.ncut.get(),
+                multiprocessing_on=False,
+                silence_index=True,
+                channel=self.channel,
+                media_info=self.media_info).preview_parts(
+                    parameters=self.params_dict, decode=False)
+
+            if preview is not None:
+                lengths = [end - start for start, end in preview]
+                self.ncut_calc.set(
+                    value=(f'(parts are {min(lengths) / 60:.1f}m - '
+                           f'{max(lengths) / 60:.1f}m by silence)'))
+        else:
+            preview = self.calc_list_of_parts(self.ncut.get(), self.duration)
+
+        # predicted split points on the waveform
+        self.split_points = [start for start, _ in (preview or [])[1:]]
+        self.draw_waveform()
+
+    def load_overview(self):
+        """
+        Build the peak pyramid (and the silence index) of the file
+        by a background process, the saved one is loaded at once
+        """
+
+        self.peak_pyramid = None
+        self.waveform_message = 'Loading the waveform...'
+        self.draw_waveform()
+
+        app = SmartAudioSplitter(
+            full_filename=self.full_filename,
+            silence_len=self.silence_len.get(),
+            multiprocessing_on=False,
+            silence_index=True,
+            channel=self.channel,
+            media_info=self.media_info)
+
+        if self.overview_pool is None:
+            self.overview_pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        future = self.overview_pool.submit(app.calc_overview,
+                                           self.full_filename, self.params_dict)
+        future.add_done_callback(
+            lambda future, filename=self.full_filename:
+                self.root.after(0, self.show_overview, future, filename))
+
+    def show_overview(self, future, filename):
+        # the file can be changed while the pyramid is building
+        if filename != self.full_filename:
+            return
+
+        try:
+            self.peak_pyramid = future.result()
+        except Exception as err:
+            self.waveform_message = f'The waveform is not loaded({err}).'
+            self.draw_waveform()
+            return
+
+        self.view = (0, self.peak_pyramid.duration)
+
+        # split points are predicted by the new silence index
+        self.parts_calc()
+
+    def draw_waveform(self):
+        """
+        Draw peaks of the view and predicted split points
+        """
+
+        canvas = self.canvas_waveform
+        canvas.delete('all')
+        width = max(canvas.winfo_width(), 1)
+        height = max(canvas.winfo_height(), 1)
+
+        if self.peak_pyramid is None or self.view[1] <= self.view[0]:
+            canvas.create_text(width // 2, height // 2, text=self.waveform_message,
+                               font=self.font[0])
+            return
+
+        start, end = self.view
+        times, mins, maxs = self.peak_pyramid.peaks(start, end, width)
+        x = (times - start) / (end - start) * width
+        middle = height / 2
+        points = np.column_stack((np.concatenate((x, x[::-1])),
+                                  np.concatenate((middle - maxs / 32768 * middle,
+                                                  middle - mins[::-1] / 32768 * middle))))
+        if len(points) >= 3:
+            canvas.create_polygon(points.ravel().tolist(),
+                                  fill='steelblue', outline='steelblue')
+
+        for point in self.split_points:
+            if start <= point <= end:
+                x = (point - start) / (end - start) * width
+                canvas.create_line(x, 0, x, height, fill='red', width=2)
+
+        times = [f'{time // 3600:.0f}:{time % 3600 // 60:02.0f}:{time % 60:04.1f}'
+                 for time in (round(start, 1), round(end, 1))]
+        canvas.create_text(4, 2, anchor='nw', font=self.font[0],
+                           text=f'{times[0]} - {times[1]}')
+
+    def zoom_waveform(self, event, factor):
+        """
+        Zoom the view around the mouse pointer
+        """
+
+        if self.peak_pyramid is None:
+            return
+
+        start, end = self.view
+        duration = self.peak_pyramid.duration
+        time = start + (end - start) * event.x / max(self.canvas_waveform.winfo_width(), 1)
+        length = min(max((end - start) * factor, 0.05), duration)
+        start = min(max(time - (time - start) * length / (end - start), 0),
+                    duration - length)
+        self.view = (start, start + length)
+        self.draw_waveform()
+
+    def pan_waveform(self, event):
+        if self.peak_pyramid is None or self.drag is None:
+            return
+
+        x, (start, end) = self.drag
+        shift = (x - event.x) * (end - start) / max(self.canvas_waveform.winfo_width(), 1)
+        shift = min(max(shift, -start), self.peak_pyramid.duration - end)
+        self.view = (start + shift, end + shift)
+        self.draw_waveform()
+
+    def reset_waveform(self):
+        if self.peak_pyramid is not None:
+            self.view = (0, self.peak_pyramid.duration)
+            self.draw_waveform()
+
     def pause_on_off(self):
         if str(self.entry_pause['state']) == 'normal':
             self.entry_pause['state'] = 'disabled'
@@ -136,7 +299,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
             self.menu_out_format['state'] = 'normal'
 
     def is_mp3(self, entry):
-        if entry.get() == 'wav':
+        if entry.get() in ('wav', 'flac'):
             self.entry_bitrate['state'] = 'disabled'
         else:
             self.entry_bitrate['state'] = 'normal'
@@ -199,6 +362,28 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
 
         step1_frame.pack(padx=10, pady=10, fill=tk.X)
 
+    def create_waveform(self):
+
+        waveform_frame = tk.LabelFrame(self.root,
+                                       text='Waveform (wheel zooms, drag pans, double click resets)',
+                                       font=self.font[2])
+
+        self.canvas_waveform = tk.Canvas(waveform_frame, height=120,
+                                         bg='white', highlightthickness=0)
+        self.canvas_waveform.bind('<Configure>', lambda event: self.draw_waveform())
+        self.canvas_waveform.bind('<MouseWheel>',
+                                  lambda event: self.zoom_waveform(
+                                      event, 0.8 if event.delta > 0 else 1.25))
+        self.canvas_waveform.bind('<Button-4>', lambda event: self.zoom_waveform(event, 0.8))
+        self.canvas_waveform.bind('<Button-5>', lambda event: self.zoom_waveform(event, 1.25))
+        self.canvas_waveform.bind('<ButtonPress-1>',
+                                  lambda event: setattr(self, 'drag', (event.x, self.view)))
+        self.canvas_waveform.bind('<B1-Motion>', self.pan_waveform)
+        self.canvas_waveform.bind('<Double-Button-1>', lambda event: self.reset_waveform())
+        self.canvas_waveform.pack(padx=4, pady=4, fill=tk.X)
+
+        waveform_frame.pack(padx=10, pady=0, fill=tk.X)
+
     def create_step2(self):
 
         step2_frame = tk.LabelFrame(self.root, text='Step 2. Config',
@@ -248,6 +433,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
                                       width=8,
                                       state=['disabled', 'normal'][self.add_pause_state.get()],
                                       font=self.font[1])
+        self.entry_silence.bind('<Return>', lambda event: self.parts_calc())
         self.entry_silence.grid(row=0, column=4, padx=4,
                                 pady=4, sticky='w')
 
@@ -292,7 +478,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         menu_out_format = ttk.Combobox(step2_frame,
                                        textvariable=self.out_format,
                                        width=6,
-                                       values=['mp3', 'wav'],
+                                       values=['mp3', 'wav', 'flac', 'opus', 'aac', 'm4a'],
                                        font=self.font[1])
         menu_out_format.bind('<<ComboboxSelected>>',
                              lambda event, entry=menu_out_format: self.is_mp3(entry))
@@ -356,6 +542,13 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
         self.menu_out_format.grid(row=0, column=2, padx=4,
                                   pady=4, sticky='w')
 
+        cancel_button = tk.Button(step3_frame,
+                                  text='Cancel',
+                                  command=self.cancel_token.cancel,
+                                  width=10,
+                                  font=self.font[1])
+        cancel_button.grid(row=0, column=3, padx=4, pady=4, sticky='e')
+
         self.progress = ttk.Progressbar(step3_frame,
                                         orient='horizontal')
         self.progress.grid(row=1, column=0, columnspan=4, padx=10,
@@ -380,6 +573,38 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
                                     self.version.split()[-1]))
         self.label_version.pack(side=tk.BOTTOM, anchor='e', pady=2, padx=10)
 
+    def show_progress(self, events):
+        """
+        Listener of the progress channel,
+        the progress bar is updated by the Tk thread
+        """
+
+        self.root.after(0, self.update_progress, events)
+
+    def update_progress(self, events):
+        """
+        Tkinter progress bar
+        """
+
+        for event in events:
+            # workers send only warnings to the progress bar
+            if not (event['main'] or event['warning']):
+                continue
+
+            if event['progress_len']:
+                self.progress['maximum'] = event['progress_len']
+
+            if event['progress_tick']:
+                self.progress['value'] = event['progress_tick']
+
+            if event['warning']:
+                self.label_progress['text'] = f"WARNING: {event['progress_message']}"
+            else:
+                self.label_progress['text'] = event['progress_message']
+
+            if event['progress_message'] == 'Done':
+                self.progress['value'] = self.progress['maximum']
+
     def start_processing(self):
         """
         After defining all parameters via the interface,
@@ -406,33 +631,18 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
                 out_filename=self.newfilename.get(),
                 format_=self.out_format.get(),
                 bitrate=self.bitrate.get(),
-                store=self.store)
+                store=self.store,
+                pcm_cache=self.pcm_cache,
+                pool=self.get_pool(self.n_jobs) if multiprocessing_on else None,
+                channel=self.channel,
+                silence_index=True,
+                media_info=self.media_info,
+                resume=True,
+                cancel_token=self.cancel_token)
             app.run()
 
-        def progress_bar():
-            """
-            Tkinter progress bar with a multiprocessing mode
-            """
-
-            maximum = None
-            works = ''
-            while works != 'Done':
-                time.sleep(1)
-                if (maximum is None and
-                        (progress_len := self.store.get('progress_len', False))):
-                    maximum = progress_len
-                    self.progress['maximum'] = maximum
-
-                if progress_tick := self.store.get('progress_tick', False):
-                    self.progress['value'] = progress_tick
-
-                if progress_message := self.store.get('progress_message', False):
-                    self.label_progress['text'] = progress_message
-                    works = progress_message
-
-                self.root.update()
-
-            self.progress['value'] = self.progress['maximum']
+            # the preview uses the saved silence index
+            self.root.after(0, self.parts_calc)
 
         # set variables
 
@@ -449,7 +659,7 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
             self.how = 'raw_split'
 
         if self.multiprocesses.get():
-            self.store = multiprocessing.Manager().dict()
+            self.store = SharedChunkStore(spill_dir=self.spill_dir)
         else:
             self.store = dict()
 
@@ -462,8 +672,8 @@ class SmartAudioSplitterTk(SmartAudioSplitter):
             thread_worker = threading.Thread(target=worker, args=(mp,), daemon=True)
             thread_worker.start()
 
-        thread_progress = threading.Thread(target=progress_bar, daemon=True)
-        thread_progress.start()
+        # the progress bar is updated by events of the channel
+        self.channel.add_listener(self.show_progress)
 
 
 if __name__ == '__main__':
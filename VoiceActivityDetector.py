@@ -0,0 +1,150 @@
+import numpy as np
+from typing import Dict, List
+
+
+class VoiceActivityDetector:
+    """
+    VoiceActivityDetector finds speech in audio without models.
+    Features of 'frame_len' ms frames (every 'hop_len' ms) are
+    calculated by vectorized blocks of frames:
+    - loudness above the noise floor (the 10th percentile of frames)
+    - the zero-crossing rate: voiced speech has few crossings,
+      breaths and hiss have many
+    - the spectral flux (the rise of the spectrum of 300-3400 Hz
+      from the previous frame): syllables change the spectrum,
+      steady noise does not
+    A frame is speech if it is loud and voiced or changing.
+    Decisions are smoothed by the majority of 'smooth_len' ms
+    and speech is extended by 'hangover' ms, so short dips
+    inside words and phrases are not pauses.
+
+    """
+
+    def __init__(self, frame_rate, frame_len=32, hop_len=10,
+                 energy_margin=6, zcr_max=0.3, flux_factor=2,
+                 smooth_len=150, hangover=100):
+        self.frame_rate = frame_rate
+        self.frame_len = frame_len
+        self.hop_len = hop_len
+        self.energy_margin = energy_margin
+        self.zcr_max = zcr_max
+        self.flux_factor = flux_factor
+        self.smooth_len = smooth_len
+        self.hangover = hangover
+        self.frame = max(2, round(frame_len * frame_rate / 1000))
+        self.hop = max(1, round(hop_len * frame_rate / 1000))
+
+    def frames(self, samples) -> np.ndarray:
+        """
+        Return frames of samples (the strided view without copying),
+        frames of samples of many channels (frames, channels) are
+        (frames, channels, frame)
+        """
+
+        if len(samples) < self.frame:
+            return np.zeros((0, self.frame), dtype=np.float32)
+
+        return np.lib.stride_tricks.sliding_window_view(
+            samples, self.frame, axis=0)[::self.hop]
+
+    def features(self, samples, scale=1) -> Dict:
+        """
+        Calc loudness (dBFS), zero-crossing rates and spectral
+        flux of frames of samples ('scale' is the full scale),
+        channels are downmixed by RMS with the sign of the first
+        channel. Frames are calculated by blocks
+        of ~256K samples in float32, so only features of frames
+        are kept for the whole audio.
+        """
+
+        frames = self.frames(samples)
+        energy = np.zeros(len(frames), dtype=np.float32)
+        zcr = np.zeros(len(frames), dtype=np.float32)
+        flux = np.zeros(len(frames), dtype=np.float32)
+
+        window = np.hanning(self.frame).astype(np.float32)
+        bins = np.fft.rfftfreq(self.frame, 1 / self.frame_rate)
+        band = (bins >= 300) & (bins <= 3400)
+        block_size = max(1, (1 << 18) // self.frame)
+        previous = None
+        for start in range(0, len(frames), block_size):
+            block = frames[start:start + block_size]
+            if block.ndim == 3:
+                squares = np.square(block, dtype=np.float32).mean(axis=1)
+                block = np.copysign(np.sqrt(squares), block[:, 0])
+            else:
+                block = block.astype(np.float32)
+            end = start + len(block)
+
+            squares = np.einsum('ij,ij->i', block, block) / (self.frame * scale ** 2)
+            with np.errstate(divide='ignore'):
+                energy[start:end] = np.maximum(10 * np.log10(squares), -120)
+
+            signs = np.signbit(block)
+            zcr[start:end] = np.count_nonzero(signs[:, 1:] != signs[:, :-1],
+                                              axis=1) / self.frame
+
+            block *= window
+            spectrum = np.abs(np.fft.rfft(block, axis=1)[:, band]).astype(np.float32)
+            # the flux is relative to the frame level, so it does not depend on loudness
+            spectrum /= spectrum.sum(axis=1, keepdims=True) + np.float32(1e-12)
+            if previous is not None:
+                flux[start] = np.maximum(spectrum[0] - previous, 0).sum()
+            flux[start + 1:end] = np.maximum(spectrum[1:] - spectrum[:-1], 0).sum(axis=1)
+            previous = spectrum[-1]
+
+        return {'energy': energy, 'zcr': zcr, 'flux': flux}
+
+    def speech(self, samples, scale=1) -> np.ndarray:
+        """
+        Return the speech flag of every hop of samples
+        """
+
+        features = self.features(samples, scale)
+        energy = features['energy']
+        if not len(energy):
+            return np.zeros(0, dtype=bool)
+
+        noise_floor = np.percentile(energy, 10)
+        loud = energy > noise_floor + self.energy_margin
+
+        # the flux of steady sound is the flux of quiet frames
+        quiet_flux = features['flux'][~loud]
+        base_flux = np.median(quiet_flux if len(quiet_flux) else features['flux'])
+        changing = features['flux'] > base_flux * self.flux_factor
+        voiced = features['zcr'] < self.zcr_max
+        speech = loud & (voiced | changing)
+
+        # the majority of frames of the smoothing window
+        window = max(1, round(self.smooth_len / self.hop_len))
+        cumulative = np.concatenate(([0], np.cumsum(speech)))
+        starts = np.clip(np.arange(len(speech)) - window // 2, 0, len(speech))
+        ends = np.clip(starts + window, 0, len(speech))
+        speech = (cumulative[ends] - cumulative[starts]) * 2 > ends - starts
+
+        # the hangover extends speech to both sides
+        hangover = round(self.hangover / self.hop_len)
+        if hangover and speech.any():
+            cumulative = np.concatenate(([0], np.cumsum(speech)))
+            indexes = np.arange(len(speech))
+            speech = (cumulative[np.minimum(indexes + hangover + 1, len(speech))] -
+                      cumulative[np.maximum(indexes - hangover, 0)]) > 0
+
+        return speech
+
+    def pauses(self, samples, min_pause_len=500, scale=1) -> List:
+        """
+        Return pauses of speech [start, end] ms
+        not shorter than 'min_pause_len' ms
+        """
+
+        speech = self.speech(samples, scale)
+        edges = np.diff(np.concatenate(([True], speech, [True])).astype(np.int8))
+        starts = np.flatnonzero(edges == -1)
+        ends = np.flatnonzero(edges == 1)
+
+        # times of hops are exact, hops are rounded to samples
+        hop_ms = self.hop * 1000 / self.frame_rate
+        return [[start * hop_ms, end * hop_ms]
+                for start, end in zip(starts, ends)
+                if (end - start) * hop_ms >= min_pause_len]
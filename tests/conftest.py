@@ -0,0 +1,33 @@
+import os
+import sys
+import wave
+import shutil
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def speech_wav(tmp_path):
+    """
+    20 s of stereo 16 kHz 'speech': 1.5 s tones with 0.7 s pauses
+    """
+
+    if shutil.which('ffmpeg') is None:
+        pytest.skip('ffmpeg is not installed')
+
+    frame_rate = 16000
+    t = np.arange(20 * frame_rate) / frame_rate
+    signal = np.sin(2 * np.pi * 220 * t) * ((t % 2.2) < 1.5) * 0.5
+    signal += np.random.default_rng(0).normal(size=len(t)) * 0.001
+    samples = (np.stack([signal, signal], axis=1) * 32767).astype('<i2')
+
+    file_name = str(tmp_path / 'speech.wav')
+    with wave.open(file_name, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(samples.tobytes())
+
+    return file_name
@@ -0,0 +1,39 @@
+import numpy as np
+import pydub
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+@pytest.fixture(scope='module')
+def splitter():
+    with SmartAudioSplitter('', multiprocessing_on=False) as worker:
+        yield worker
+
+
+def stereo_chunk(left, right, frame_rate=44100):
+    samples = np.stack([left, right], axis=1)
+    return pydub.AudioSegment(data=samples.astype('<i2').tobytes(),
+                              sample_width=2, frame_rate=frame_rate, channels=2)
+
+
+@pytest.mark.parametrize('kind', ['uncorrelated', 'antiphase', 'same'])
+def test_loudness_of_channels_is_kept(splitter, kind):
+    rng = np.random.default_rng(0)
+    left = rng.normal(size=44100 * 2) * 3000
+    right = {'uncorrelated': rng.normal(size=44100 * 2) * 3000,
+             'antiphase': -left, 'same': left}[kind]
+    chunk = stereo_chunk(left, right)
+
+    mono = splitter.analysis_chunk(chunk)
+    assert mono.channels == 1
+    assert mono.frame_rate == 8820
+    assert abs(mono.dBFS - chunk.dBFS) < 0.1
+
+
+def test_zero_crossings_follow_the_first_channel(splitter):
+    t = np.arange(44100) / 44100
+    left = np.sin(2 * np.pi * 100 * t) * 10000
+    chunk = stereo_chunk(left, left * 0.5)
+
+    mono = np.array(splitter.analysis_chunk(chunk).get_array_of_samples())
+    assert np.array_equal(np.sign(mono), np.sign(left.astype('<i2')[::5]))
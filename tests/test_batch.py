@@ -0,0 +1,55 @@
+import os
+import shutil
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter, main
+
+
+@pytest.mark.parametrize('add_pause', [False, True])
+def test_batch_lossless_splits_all_files(speech_wav, tmp_path, add_pause):
+    # parts with pauses can not be cut losslessly and are re-encoded
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    for name in ('a.wav', 'b.wav'):
+        shutil.copy(speech_wav, in_dir / name)
+
+    out_filename = str(tmp_path / 'out' / 'part')
+    with SmartAudioSplitter(str(in_dir), n_split=3, format_='wav',
+                            out_filename=out_filename, how='raw_split',
+                            add_pause=add_pause, lossless=True,
+                            n_jobs=2) as worker:
+        worker.run()
+
+    assert worker.errors == 0
+    for name in ('a', 'b'):
+        for i in range(1, 4):
+            assert os.path.exists(str(tmp_path / 'out' / name / f'part_{i}'))
+
+
+def test_batch_counts_errors_of_workers(speech_wav, tmp_path):
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    shutil.copy(speech_wav, in_dir / 'a.wav')
+
+    out_filename = str(tmp_path / 'out' / 'part')
+    with SmartAudioSplitter(str(in_dir), n_split=3, format_='wav',
+                            out_filename=out_filename, how='raw_split',
+                            add_pause=True, lossless=True,
+                            n_jobs=2) as worker:
+        # the part can not be written in place of the directory
+        os.makedirs(str(tmp_path / 'out' / 'a' / 'part_2'))
+        worker.run()
+
+    assert worker.errors
+
+
+def test_console_exit_code_counts_errors_of_workers(speech_wav, tmp_path):
+    in_dir = tmp_path / 'in'
+    in_dir.mkdir()
+    shutil.copy(speech_wav, in_dir / 'a.wav')
+    os.makedirs(str(tmp_path / 'out' / 'a' / 'part_2'))
+
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(in_dir), '-o', str(tmp_path / 'out' / 'part'), '-n', '3',
+              '-f', 'wav', '--how', 'raw_split', '--lossless', '-j', '2'])
+
+    assert exit_info.value.code == 1
@@ -0,0 +1,102 @@
+import numpy as np
+import pydub
+import pydub.silence
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+@pytest.fixture(scope='module')
+def splitter():
+    with SmartAudioSplitter('', multiprocessing_on=False) as worker:
+        yield worker
+
+
+def make_chunk(samples, frame_rate=8000):
+    return pydub.AudioSegment(data=np.asarray(samples, dtype='<i2').tobytes(),
+                              sample_width=2, frame_rate=frame_rate, channels=1)
+
+
+def random_chunk(rng):
+    frame_rate = int(rng.choice([8000, 16000]))
+    frames = int(rng.integers(frame_rate * 10, frame_rate * 40))
+    samples = rng.normal(size=frames) * rng.uniform(100, 10000)
+    # quiet gaps of random lengths and levels
+    for _ in range(rng.integers(0, 20)):
+        start = int(rng.integers(0, frames))
+        end = start + int(rng.integers(1, frame_rate))
+        samples[start:end] *= rng.uniform(0, 0.05)
+    samples = np.clip(samples, -32768, 32767)
+
+    return make_chunk(samples, frame_rate)
+
+
+def pydub_split_point(chunk, min_silence_len, silence_thresh):
+    """
+    The split point of the original detector: pydub.silence.detect_silence
+    in the last ~5%, ~11%, ~18% of the chunk, the threshold is increased
+    by 10% until any region has silence
+    """
+
+    chunk_len = len(chunk)
+    time_calc_silence = chunk_len
+    silence = []
+    iteration = 0
+    while not len(silence):
+        if iteration > 2:
+            silence_thresh -= 0.1 * silence_thresh
+            time_calc_silence = chunk_len
+            iteration = 0
+
+        time_calc_silence -= chunk_len // (20 - iteration * 3)
+        silence = pydub.silence.detect_silence(
+            chunk[time_calc_silence:],
+            min_silence_len=min_silence_len,
+            silence_thresh=silence_thresh)
+        iteration += 1
+
+    return time_calc_silence + sum(silence[-1]) / 2
+
+
+def split_point(splitter, chunk, min_silence_len, silence_thresh):
+    regions = splitter.calc_search_regions(len(chunk))
+    envelope = splitter.calc_loudness_envelope(chunk[regions[-1]:])
+
+    return splitter.find_split_point(envelope, regions, min_silence_len,
+                                     silence_thresh)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_signals(splitter, seed):
+    rng = np.random.default_rng(seed)
+    chunk = random_chunk(rng)
+    min_silence_len = int(rng.choice([50, 200, 500]))
+    silence_thresh = float(rng.uniform(-60, -20))
+
+    assert (split_point(splitter, chunk, min_silence_len, silence_thresh) ==
+            pydub_split_point(chunk, min_silence_len, silence_thresh))
+
+
+def test_silence_in_the_shortest_region(splitter):
+    samples = np.random.default_rng(0).normal(size=8000 * 20) * 8000
+    samples[8000 * 19:8000 * 19 + 8 * 600] = 0
+    chunk = make_chunk(samples)
+
+    assert split_point(splitter, chunk, 500, -40) == 19300
+    assert pydub_split_point(chunk, 500, -40) == 19300
+
+
+def test_threshold_is_increased_without_silence(splitter):
+    # the quiet gap is above the threshold
+    samples = np.random.default_rng(1).normal(size=8000 * 20) * 8000
+    samples[8000 * 18:8000 * 18 + 8 * 600] *= 0.05
+    chunk = make_chunk(samples)
+    events = []
+    splitter.channel.add_listener(events.extend)
+
+    assert (split_point(splitter, chunk, 500, -60) ==
+            pydub_split_point(chunk, 500, -60))
+    splitter.channel.flush()
+    splitter.channel.remove_listener(events.extend)
+    assert any(event['warning'] and
+               event['progress_message'].startswith('Detecting silence')
+               for event in events)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+@pytest.fixture
+def splitter():
+    return SmartAudioSplitter('', multiprocessing_on=False)
+
+
+def energy_map(pause_share, duration=120_000, pause_len=600, seed=0):
+    """
+    The energy map (1 ms) of steady -20 dBFS content with -60 dBFS
+    pauses of 'pause_len' ms, pauses are 'pause_share' of the time
+    """
+
+    rng = np.random.default_rng(seed)
+    levels = -20 + rng.normal(size=duration)
+    n_pauses = round(duration * pause_share / pause_len)
+    starts = np.linspace(0, duration, n_pauses + 2)[1:-1].astype(int)
+    for start in starts:
+        levels[start:start + pause_len] = -60 + rng.normal(size=pause_len)
+
+    return 10 ** (levels / 10), starts
+
+
+@pytest.mark.parametrize('pause_share', [0.03, 0.05, 0.09, 0.3])
+def test_sparse_pauses_are_found(splitter, pause_share):
+    energy, starts = energy_map(pause_share)
+    estimate = splitter.estimate_noise_floor(splitter.calc_level_histogram(energy))
+
+    assert estimate['method'] == 'otsu'
+    # the threshold is between pauses and content
+    assert -55 < estimate['silence_thresh'] < -25
+    assert estimate['noise_floor'] < -55
+
+    silences = splitter.find_silences(energy, 500, estimate['silence_thresh'])
+    assert len(silences) == len(starts)
+    assert np.all(np.abs(silences[:, 0] - starts) <= 10)
+
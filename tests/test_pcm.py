@@ -0,0 +1,56 @@
+import wave
+import numpy as np
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+@pytest.fixture
+def wav_8bit(speech_wav, tmp_path):
+    """
+    The 'speech' fixture as 8 bit WAV (unsigned samples)
+    """
+
+    with wave.open(speech_wav) as f:
+        params = f.getparams()
+        samples = np.frombuffer(f.readframes(params.nframes), dtype='<i2')
+
+    file_name = str(tmp_path / 'speech_8bit.wav')
+    with wave.open(file_name, 'wb') as f:
+        f.setnchannels(params.nchannels)
+        f.setsampwidth(1)
+        f.setframerate(params.framerate)
+        f.writeframes(((samples >> 8) + 128).astype(np.uint8).tobytes())
+
+    return file_name
+
+
+def read_frames(file_name):
+    with wave.open(file_name) as f:
+        assert f.getsampwidth() == 1
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.uint8)
+
+
+def test_8bit_wav_round_trip(wav_8bit, tmp_path):
+    out_filename = str(tmp_path / 'part')
+    with SmartAudioSplitter(wav_8bit, n_split=2, format_='wav',
+                            how='raw_split', out_filename=out_filename,
+                            add_pause=False, multiprocessing_on=False) as worker:
+        worker.run()
+
+    parts = np.concatenate([read_frames(f'{out_filename}_{i}') for i in (1, 2)])
+    assert np.array_equal(parts, read_frames(wav_8bit))
+
+
+def test_8bit_wav_pauses_are_silent(wav_8bit, tmp_path):
+    out_filename = str(tmp_path / 'part')
+    with SmartAudioSplitter(wav_8bit, n_split=2, format_='wav',
+                            how='raw_split', out_filename=out_filename,
+                            add_pause=True, pause_len=500,
+                            multiprocessing_on=False) as worker:
+        worker.run()
+
+    pause = 16000 * 2 // 2
+    for i in (1, 2):
+        frames = read_frames(f'{out_filename}_{i}')
+        # silence of unsigned samples is 128
+        assert np.all(frames[-pause:] == 128)
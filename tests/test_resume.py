@@ -0,0 +1,29 @@
+import os
+import pytest
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+@pytest.mark.parametrize('multiprocessing_on', [False, True])
+def test_resume_exports_only_deleted_parts(speech_wav, tmp_path,
+                                           multiprocessing_on):
+    out_filename = str(tmp_path / 'part')
+
+    def run():
+        with SmartAudioSplitter(speech_wav, n_split=4, format_='wav',
+                                out_filename=out_filename, add_pause=False,
+                                multiprocessing_on=multiprocessing_on,
+                                n_jobs=2, n_encoders=1, resume=True) as worker:
+            worker.run()
+
+    run()
+    parts = [f'{out_filename}_{i}' for i in range(1, 5)]
+    stamps = {part: os.stat(part).st_mtime_ns for part in parts}
+
+    os.remove(parts[0])
+    os.remove(parts[1])
+    run()
+
+    assert all(os.path.exists(part) for part in parts)
+    # exported parts are not written again
+    assert os.stat(parts[2]).st_mtime_ns == stamps[parts[2]]
+    assert os.stat(parts[3]).st_mtime_ns == stamps[parts[3]]
@@ -0,0 +1,29 @@
+import os
+import pydub
+from SmartAudioSplitter import SmartAudioSplitter
+
+
+def test_parts_are_spilled_to_spill_dir(tmp_path):
+    with SmartAudioSplitter('', spill_dir=str(tmp_path)) as worker:
+        store = worker.store
+        store.set(1, pydub.AudioSegment.silent(1000), spill=True)
+        name = store.store[1]['blocks'][0][0]
+
+        assert os.path.dirname(name) == str(tmp_path)
+        store.release()
+
+    assert not os.listdir(tmp_path)
+
+
+def test_streaming_with_spill_dir(speech_wav, tmp_path):
+    spill_dir = tmp_path / 'spill'
+    spill_dir.mkdir()
+    out_filename = str(tmp_path / 'part')
+    with SmartAudioSplitter(speech_wav, n_split=3, format_='wav', streaming=True,
+                            out_filename=out_filename, add_pause=False,
+                            spill_dir=str(spill_dir)) as worker:
+        worker.run()
+
+    assert worker.errors == 0
+    assert all(os.path.exists(f'{out_filename}_{i}') for i in range(1, 4))
+    assert not os.listdir(spill_dir)